@@ -4,28 +4,37 @@
 
 import argparse
 import os
+import re
 import shutil
 import sqlite3
 import sys
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from errno import EEXIST
-from exiftool import ExifTool, fsencode
+from exiftool import ExifTool, ExifToolPool, fsencode
 from signal import signal, SIGINT
 from tempfile import mkdtemp
 
 # Closes database and deletes temporary files.
-def cleanUp():
+def cleanUp(interrupted=False):
     db.close()
     shutil.rmtree(tempDir)
     print("\nDeleted temporary files")
 
     if 'et' in globals():
-        et.terminate()
+        if interrupted and isinstance(et, ExifToolPool):
+            # the interrupted thread may hold a worker it will never give back
+            et.terminate(timeout=0)
+        else:
+            et.terminate()
         print("Closed ExifTool.")
 
 def cleanOnInterrupt(signal, frame):
-    cleanUp()
+    cleanUp(interrupted=True)
     sys.exit(0)
 
 # Clean up after ourselves in case the script is interrupted.
@@ -36,6 +45,17 @@ def ensureDirExists(path):
     if not os.path.isdir(path):
         os.makedirs(path)
 
+# Seconds spent per phase, printed at the end.
+timings = dict()
+
+@contextmanager
+def timed(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.time() - start
+
 # Shows a helpful progress bar.
 def showProgressBar(total, completed):
     progress = completed / total * 100
@@ -65,6 +85,14 @@ def getArgs(argv=None):
                         help="append location to directory names.")
     parser.add_argument('-r', '--region', default=False, action="store_true",
                         help="prepend region information to locations.")
+    parser.add_argument('--faces-preload', type=int, default=500000,
+                        help="load all face names up front with one query if the \
+                        library has at most this many tagged faces, otherwise \
+                        per day in chunks; 0 - one query per photo as before")
+    parser.add_argument('--exif-workers', type=int, default=1,
+                        help="ExifTool processes reading and writing EXIF in parallel")
+    parser.add_argument('--exif-batch', type=int, default=200,
+                        help="files whose EXIF is written with one ExifTool round trip")
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-p', '--progress', default=True, action="store_true",
                         help="show a bar indicating copying progress")
@@ -112,8 +140,73 @@ def facesByUuid(uuId):
     return [f["name"] for f in faces]
 
 
-def currentDateInExif(fileName):
-    currentExif = et.get_tags(("EXIF:DateTimeOriginal", "EXIF:CreateDate"), fileName)
+class FaceNames(object):
+    """
+    Face names of photos, by image uuid, looked up in bulk instead of with
+    one RKPerson/RKFace query per photo.
+
+    preload() reads the names of every photo with a single query, fetched
+    chunk_size rows at a time. For libraries too big to hold that,
+    prefetch() loads just the photos of one day stack, chunk_size uuids per
+    query, and forget() drops them once the stack is done.
+    """
+    QUERY = '''
+        SELECT f.imageId, p.name
+        FROM RKFace AS f
+        INNER JOIN RKPerson AS p ON p.modelId = f.personId
+        %s
+        GROUP BY f.imageId, p.modelId
+        ORDER BY f.imageId'''
+
+    def __init__(self, cursor, chunk_size=500):
+        self.cursor = cursor
+        self.chunk_size = chunk_size
+        self.names = dict()
+        self.complete = False
+        self.queries = 0
+
+    def load(self, where='', params=()):
+        self.cursor.execute(self.QUERY % where, params)
+        self.queries += 1
+        while True:
+            rows = self.cursor.fetchmany(self.chunk_size)
+            if not rows:
+                break
+            for imageId, name in rows:
+                self.names.setdefault(imageId, []).append(name)
+
+    def preload(self):
+        with timed('faces'):
+            self.load()
+        self.complete = True
+
+    def prefetch(self, uuids):
+        if self.complete:
+            return
+        missing = [u for u in uuids if u not in self.names]
+        with timed('faces'):
+            for i in range(0, len(missing), self.chunk_size):
+                chunk = missing[i:i + self.chunk_size]
+                self.load('WHERE f.imageId IN (%s)' % ', '.join('?' * len(chunk)), chunk)
+                for u in chunk:
+                    self.names.setdefault(u, [])
+
+    def forget(self, uuids):
+        if not self.complete:
+            for u in uuids:
+                self.names.pop(u, None)
+
+    def __call__(self, uuId):
+        if not self.complete and uuId not in self.names:
+            self.prefetch([uuId])
+        return self.names.get(uuId, [])
+
+
+EXIF_DATE_TAGS = ("EXIF:DateTimeOriginal", "EXIF:CreateDate")
+KEYWORDS_TAG = "IPTC:Keywords"
+
+
+def currentDateInExif(currentExif):
     if 'EXIF:CreateDate' in currentExif:
         return currentExif['EXIF:CreateDate']
     elif 'EXIF:DateTimeOriginal' in currentExif:
@@ -122,14 +215,96 @@ def currentDateInExif(fileName):
         return ""
 
 
-def setDateInExif(fileName, formattedDate):
-    cmd = map(fsencode, ['-EXIF:DateTimeOriginal=%s' % formattedDate, '-EXIF:CreateDate=%s' % formattedDate, '-overwrite_original', fileName])
-    et.execute(*cmd)
-
+def currentKeywords(currentExif):
+    keywords = currentExif.get(KEYWORDS_TAG, [])
+    if not isinstance(keywords, list):
+        keywords = [keywords]
+    return [str(k) for k in keywords]
+
+
+def exifTags(row, faces):
+    """Tags to read for a photo: the dates (JPEG only) and keywords if it has faces."""
+    extension = os.path.splitext(row["fileName"])[1].lower()
+    checkDate = args.exif and extension in ('.jpg', '.jpeg')
+    return (EXIF_DATE_TAGS if checkDate else ()) + ((KEYWORDS_TAG,) if faces else ())
+
+
+def exifChanges(currentExif, row, faces):
+    """
+    Compares the tags read from a photo with what they should be.
+    :return: list of ExifTool tag assignments, empty if nothing changes
+    """
+    changes = []
+    if EXIF_DATE_TAGS[0] in exifTags(row, faces):
+        compareDate = currentDateInExif(currentExif)
+        desiredDate = photoTimestamp(row).strftime("%Y:%m:%d %H:%M:%S")
+
+        # Do we need to set a date ourselves?
+        if compareDate != desiredDate:
+            if args.verbose:
+                print ("> EXIF date '%s' will be replaced with '%s'" % (compareDate, desiredDate))
+            changes += ['-EXIF:DateTimeOriginal=%s' % desiredDate, '-EXIF:CreateDate=%s' % desiredDate]
+
+    if faces and sorted(set(currentKeywords(currentExif))) != sorted(set(faces)):
+        changes += ['-keywords={0}'.format(word) for word in faces]
+
+    return changes
+
+
+class ExifWriter(object):
+    """
+    Collects the tag changes of many files and sends them to ExifTool as
+    one batch of -execute groups, batch_size files at a time, instead of
+    one command (and one round trip) per file. With an executor (and an
+    ExifToolPool as et) batches are written in the background, several at
+    a time.
+    """
+    UPDATED = re.compile(br'(\d+) image files updated')
+
+    def __init__(self, et, batch_size=200, executor=None):
+        self.et = et
+        self.batch_size = max(1, batch_size)
+        self.executor = executor
+        self.futures = []
+        self.lock = threading.Lock()
+        self.pending = []
+        self.updated = 0
+        self.failed = []
+
+    def add(self, fileName, changes):
+        self.pending.append((fileName, changes))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        if self.executor is not None:
+            self.futures.append(self.executor.submit(self.write, batch))
+        else:
+            self.write(batch)
+
+    def write(self, batch):
+        groups = [[fsencode(c) for c in changes + ['-overwrite_original', fileName]]
+                  for fileName, changes in batch]
+        with timed('exif write'):
+            outputs = self.et.execute_batch(*groups)
+        for (fileName, _), output in zip(batch, outputs):
+            o = self.UPDATED.search(output)
+            with self.lock:
+                if o is not None and int(o.group(1)) > 0:
+                    self.updated += 1
+                else:
+                    self.failed.append(fileName)
+                    print ("\nEXIF not updated: %s" % fileName)
 
-def setExifKeywords(fileName, keywords):
-    cmd = map(fsencode, ['-keywords={0}'.format(word) for word in keywords] + ['-overwrite_original', fileName])
-    et.execute(*cmd)
+    def close(self):
+        """Writes what is left and waits for batches still being written."""
+        self.flush()
+        for future in self.futures:
+            future.result()
+        self.futures = []
 
 
 # Cocoa/Webkit uses a different epoch rather than the standard UNIX epoch.
@@ -165,29 +340,52 @@ def copyPhoto(row, destinationSubDir):
         return (destinationFile, 2);
 
 
-# TODO: merge calls to exiftool.
-def postProcessPhoto(fileName, row):
-    # Do we need to set some EXIF data while we're at it?
-    if args.exif:
-        extension = os.path.splitext(row["fileName"])[1].lower()
-        if extension == '.jpg' or extension == '.jpeg':
-            compareDate = currentDateInExif(fileName)
-            desiredDate = photoTimestamp(row).strftime("%Y:%m:%d %H:%M:%S")
-
-            # Do we need to set a date ourselves?
-            if compareDate != desiredDate:
-                if args.verbose:
-                    print ("> EXIF date '%s' will be replaced with '%s'" % (compareDate, desiredDate))
-
-                setDateInExif(destinationFile, desiredDate)
-
-    # Set faces as EXIF keywords.
-    if args.faces:
-        faces = facesByUuid(row["uuid"])
-        if len(faces) and args.verbose:
-            print ("> Faces:", ', '.join([face for face in faces]))
-
-        setExifKeywords(fileName, faces)
+def readTags(tags, fileNames):
+    """et.get_tags_batch(), split over the ExifTool workers if there are several."""
+    if exifThreads is None or len(fileNames) < 2 * args.exif_workers:
+        return et.get_tags_batch(tags, fileNames)
+    size = -(-len(fileNames) // args.exif_workers)
+    chunks = [fileNames[i:i + size] for i in range(0, len(fileNames), size)]
+    return [d for part in exifThreads.map(lambda chunk: et.get_tags_batch(tags, chunk), chunks)
+            for d in part]
+
+
+def postProcessStack(photos, writer):
+    """
+    Sets EXIF date (JPEG only) and faces as keywords for (fileName, row)
+    pairs of a day stack. Current tags of all of them are read with one
+    ExifTool call, changed files are queued on writer.
+    :return: number of files queued for writing
+    """
+    todo = []
+    for fileName, row in photos:
+        faces = []
+        if args.faces:
+            if faceNames is not None:
+                faces = faceNames(row["uuid"])
+            else:
+                with timed('faces'):
+                    faces = facesByUuid(row["uuid"])
+            if len(faces) and args.verbose:
+                print ("> Faces:", ', '.join([face for face in faces]))
+        tags = exifTags(row, faces)
+        if tags:
+            todo.append((fileName, row, faces, tags))
+    if not todo:
+        return 0
+
+    tags = sorted(set(t for _, _, _, photoTags in todo for t in photoTags))
+    with timed('exif read'):
+        current = readTags(tags, [fileName for fileName, _, _, _ in todo])
+    currentByFile = dict((d.get("SourceFile"), d) for d in current)
+
+    queued = 0
+    for fileName, row, faces, _ in todo:
+        changes = exifChanges(currentByFile.get(fileName, {}), row, faces)
+        if changes:
+            writer.add(fileName, changes)
+            queued += 1
+    return queued
 
 if __name__ == '__main__':
 
@@ -239,6 +437,14 @@ if __name__ == '__main__':
         numFaces = fdb.fetchone()[0];
         print ("Found %d tagged faces." % numFaces)
 
+        faceNames = None
+        if args.faces_preload:
+            faceNames = FaceNames(fconn.cursor())
+            if numFaces <= args.faces_preload:
+                faceNames.preload()
+                print ("Loaded names of faces in %d photos in %.2f s." % (
+                    len(faceNames.names), timings['faces']))
+
     # What about places?
     if args.location:
         placesDbPath = os.path.join(tempDir, 'Properties.apdb')
@@ -258,13 +464,21 @@ if __name__ == '__main__':
     if numImages == 0:
         sys.exit(0)
 
-    if args.exif:
-        et = ExifTool();
+    if args.exif or args.faces:
+        if args.exif_workers > 1:
+            et = ExifToolPool(args.exif_workers)
+            exifThreads = ThreadPoolExecutor(max_workers=args.exif_workers)
+        else:
+            et = ExifTool()
+            exifThreads = None
         et.start();
 
     index = 0
     copied = 0
     ignored = 0
+    writer = None
+    if args.exif or args.faces:
+        writer = ExifWriter(et, args.exif_batch, exifThreads)
 
     stack = []
     stack_timestamp = ""
@@ -308,7 +522,11 @@ if __name__ == '__main__':
                 if args.verbose:
                     print ("Destination subdir for stack (%d photos): \"%s\"" % (len(stack), destinationSubDir))
 
+                if args.faces and faceNames is not None:
+                    faceNames.prefetch([photo["uuid"] for photo in stack])
+
                 # Copy and process files in the stack.
+                copiedStack = []
                 for photo in stack:
                     # Copy the file if it's not in its destination yet.
                     (destinationFile, status) = copyPhoto(photo, destinationSubDir)
@@ -317,15 +535,22 @@ if __name__ == '__main__':
                     elif status == 2:
                         ignored += 1
 
-                    # Apply post-processing.
+                    # Post-processed below, once the stack is copied.
                     if not args.dryrun:
-                        postProcessPhoto(destinationFile, photo)
+                        copiedStack.append((destinationFile, photo))
 
                     # Keep track of our progress.
                     index += 1
                     if args.progress:
                         showProgressBar(numImages, index)
 
+                # Apply post-processing to the whole stack at once.
+                if writer is not None and len(copiedStack):
+                    postProcessStack(copiedStack, writer)
+
+                if args.faces and faceNames is not None:
+                    faceNames.forget([photo["uuid"] for photo in stack])
+
                 if args.verbose:
                     print ("")
 
@@ -345,8 +570,20 @@ if __name__ == '__main__':
                         print ("No place info")
 
 
+    if writer is not None:
+        writer.close()
+        if exifThreads is not None:
+            exifThreads.shutdown()
+
     print ("Copying completed.")
     print ("%d files copied" % copied)
     print ("%d files ignored" % ignored)
+    if writer is not None:
+        print ("%d files with EXIF updated, %d failed" % (writer.updated, len(writer.failed)))
+    for name in sorted(timings):
+        print ("%s: %.2f s" % (name, timings[name]))
+    if args.faces:
+        print ("Face names: %d queries" % (
+            faceNames.queries if faceNames is not None else index))
 
     cleanUp()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+# Upload throughput benchmark against a local stand-in for the Flickr API.
+#
+#   ./flickr_bench.py --files 1000,10000 --dirs 20 --size 100 --latency 0.02 -j 8
+#
+# The mock server speaks just enough of the REST and upload endpoints for
+# flickr_up.upload_dir_rec: upload, photosets.getList/create/addPhoto/
+# editPhotos. Latency, failures and a rate limit can be injected. At the end
+# the photosets on the server are checked to hold every uploaded photo.
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+import flickrapi
+from flickrapi.auth import FlickrAccessToken
+import flickr_cli
+import flickr_http
+import flickr_ledger
+import flickr_throttle
+import flickr_up
+
+
+class MockFlickr(object):
+    """State and behaviour of the fake service, shared by handler threads."""
+    def __init__(self, latency=0.0, per_mb=0.0, fail=0.0, rate_limit=0):
+        self.latency = latency
+        self.per_mb = per_mb
+        self.fail = fail
+        self.rate_limit = rate_limit
+        self.lock = threading.Lock()
+        self.next_id = 1000
+        self.photosets = dict()
+        self.uploaded = []
+        self.dropped = 0
+        self.calls = dict()
+        self.failures = 0
+        self.limited = 0
+        self.window = (0, 0)
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return str(self.next_id)
+
+    def admit(self, method):
+        """:return: HTTP status to answer with, 200 if the call goes through"""
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if self.rate_limit:
+                second, count = self.window
+                now = int(time.time())
+                count = count + 1 if now == second else 1
+                self.window = (now, count)
+                if count > self.rate_limit:
+                    self.limited += 1
+                    return 429
+            if self.fail and random.random() < self.fail:
+                self.failures += 1
+                return 500
+        return 200
+
+    def membership(self):
+        """
+        :return: (photos uploaded, photos in no photoset, photos editPhotos
+                  took out of a set)
+        """
+        with self.lock:
+            in_sets = set()
+            for s in self.photosets.values():
+                in_sets.update(s['photos'])
+            return len(self.uploaded), len(set(self.uploaded) - in_sets), self.dropped
+
+    def rest(self, method, params):
+        get = lambda k, d=None: params.get(k, [d])[0]
+        if method == 'flickr.photosets.getList':
+            page, per_page = int(get('page', 1)), int(get('per_page', 500))
+            with self.lock:
+                sets = sorted(self.photosets.items())
+            pages = max(1, (len(sets) + per_page - 1) // per_page)
+            items = ''.join('<photoset id="%s"><title>%s</title></photoset>'
+                            % (i, escape(s['title']))
+                            for i, s in sets[(page - 1) * per_page:page * per_page])
+            return '<photosets page="%d" pages="%d" perpage="%d" total="%d">%s</photosets>' % (
+                page, pages, per_page, len(sets), items)
+        if method == 'flickr.photosets.create':
+            photoset_id = self.new_id()
+            with self.lock:
+                self.photosets[photoset_id] = {'title': get('title'),
+                                               'photos': [get('primary_photo_id')]}
+            return '<photoset id="%s" />' % photoset_id
+        if method == 'flickr.photosets.addPhoto':
+            with self.lock:
+                self.photosets[get('photoset_id')]['photos'].append(get('photo_id'))
+            return ''
+        if method == 'flickr.photosets.editPhotos':
+            with self.lock:
+                photoset = self.photosets[get('photoset_id')]
+                photos = get('photo_ids').split(',')
+                self.dropped += len(set(photoset['photos']) - set(photos))
+                photoset['photos'] = photos
+            return ''
+        return None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, inner='', stat='ok'):
+        body = ('<?xml version="1.0" encoding="utf-8" ?>\n<rsp stat="%s">%s</rsp>'
+                % (stat, inner)).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        mock = self.server.mock
+        length = int(self.headers.get('Content-Length', 0))
+        left = length
+        data = []
+        while left:
+            chunk = self.rfile.read(min(left, 1 << 20))
+            if not chunk:
+                break
+            left -= len(chunk)
+            if not self.path.startswith('/services/upload'):
+                data.append(chunk)
+        if self.path.startswith('/services/upload'):
+            method = 'upload'
+        else:
+            params = parse_qs(urlparse(self.path).query)
+            params.update(parse_qs(b''.join(data).decode('utf8')))
+            method = params.get('method', ['?'])[0]
+        status = mock.admit(method)
+        time.sleep(mock.latency + mock.per_mb * length / 1e6)
+        if status != 200:
+            self.reply(status, stat='fail')
+        elif method == 'upload':
+            photo_id = mock.new_id()
+            with mock.lock:
+                mock.uploaded.append(photo_id)
+            self.reply(200, '<photoid>%s</photoid>' % photo_id)
+        else:
+            inner = mock.rest(method, params)
+            if inner is None:
+                self.reply(200, '<err code="112" msg="Method not found" />', 'fail')
+            else:
+                self.reply(200, inner)
+
+
+def start_server(mock):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+    server.mock = mock
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class TimedFlickr(object):
+    """Records client side latency of every API call, per method."""
+    def __init__(self, flickr):
+        self.flickr = flickr
+        self.lock = threading.Lock()
+        self.latencies = dict()
+
+    def __getattr__(self, name):
+        attr = getattr(self.flickr, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.latencies.setdefault(name, []).append(time.time() - start)
+        return call
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))] if values else 0.0
+
+
+def make_tree(root, files, dirs, size):
+    """Writes files JPEG-looking files of size KiB spread over dirs directories."""
+    header = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+    payload = os.urandom(size * 1024)
+    for n in range(files):
+        d = os.path.join(root, 'dir%04d' % (n % dirs))
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        with open(os.path.join(d, 'img%06d.jpg' % n), 'wb') as fd:
+            # unique bytes per file so --dedup does not skip them
+            fd.write(header + str(n).encode() + payload)
+
+
+def run(args, files):
+    mock = MockFlickr(args.latency, args.per_mb, args.fail, args.rate_limit)
+    server = start_server(mock)
+    root = tempfile.mkdtemp(prefix='flickr_bench')
+    try:
+        make_tree(root, files, min(args.dirs, files), args.size)
+        total_bytes = sum(os.path.getsize(os.path.join(d, f))
+                          for d, _, fs in os.walk(root) for f in fs)
+
+        url = 'http://127.0.0.1:%d/services/' % server.server_port
+        flickr = flickrapi.FlickrAPI(u'key', u'secret', store_token=False,
+                                     token=FlickrAccessToken(u'token', u'secret', u'write'))
+        flickr.REST_URL = url + 'rest/'
+        flickr.UPLOAD_URL = url + 'upload/'
+        in_flight = max(1, args.jobs * args.dir_jobs)
+        http = flickr_http.install_session(flickr, in_flight)
+        throttled = flickr_throttle.ThrottledFlickr(
+            flickr, rate=args.rate, burst=args.burst, max_in_flight=in_flight)
+        timed = TimedFlickr(throttled)
+
+        options = flickr_up.getArgs([root, '-r' if args.per_dir_sets else '-R',
+                                     '-j', str(args.jobs),
+                                     '--dir-jobs', str(args.dir_jobs),
+                                     '--retry-delay', '0.2']
+                                    + (['--stream'] if args.stream else [])
+                                    + (['--set-batch', str(args.set_batch)]
+                                       if args.set_batch else []))
+        ledger = flickr_ledger.open_ledger()
+        cache = flickr_cli.PhotosetCache(timed)
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            flickr_up.upload_dir_rec(timed, options, ledger, cache)
+        elapsed = time.time() - start
+        ledger.close()
+    finally:
+        shutil.rmtree(root)
+        server.shutdown()
+        server.server_close()
+
+    calls = sum(len(v) for v in timed.latencies.values())
+    print("%7d files %8.1f MB %7.1f s %8.1f files/s %7.2f MB/s %5.2f calls/file "
+          "(%d failed, %d rate limited)" % (
+              files, total_bytes / 1e6, elapsed, files / elapsed,
+              total_bytes / 1e6 / elapsed, float(calls) / files,
+              mock.failures, mock.limited))
+    for name, values in sorted(timed.latencies.items()):
+        print("        %-22s %7d calls  p50 %7.1f ms  p99 %7.1f ms" % (
+            name, len(values), percentile(values, 50) * 1000,
+            percentile(values, 99) * 1000))
+    print("        %s" % throttled.stats())
+    print("        %s" % http.stats())
+    uploaded, missing, dropped = mock.membership()
+    print("        photosets: %d, %d of %d uploaded photos in a set%s%s" % (
+        len(mock.photosets), uploaded - missing, uploaded,
+        " - %d MISSING" % missing if missing else "",
+        " - %d REMOVED by editPhotos" % dropped if dropped else ""))
+
+
+def getArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--files', default='1000',
+                        help="comma separated tree sizes to benchmark")
+    parser.add_argument('--dirs', type=int, default=10,
+                        help="directories the files are spread over")
+    parser.add_argument('--size', type=int, default=50,
+                        help="KiB per file")
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help="uploads in flight per directory")
+    parser.add_argument('--dir-jobs', dest="dir_jobs", type=int, default=2,
+                        help="directories uploaded at the same time")
+    parser.add_argument('--stream', action="store_true", default=False,
+                        help="add photos to photosets as they upload")
+    parser.add_argument('--set-batch', dest="set_batch", type=int, default=0,
+                        help="add photos to photosets every N uploads")
+    parser.add_argument('-r', dest="per_dir_sets", action="store_true",
+                        default=False,
+                        help="one photoset per directory instead of one for all")
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="seconds the server waits before each answer")
+    parser.add_argument('--per-mb', dest="per_mb", type=float, default=0.0,
+                        help="extra seconds per MB of request body")
+    parser.add_argument('--fail', type=float, default=0.0,
+                        help="fraction of calls answered with HTTP 500")
+    parser.add_argument('--rate-limit', dest="rate_limit", type=int, default=0,
+                        help="calls per second before HTTP 429, 0 - none")
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help="client side calls per second, 0 - no limit")
+    parser.add_argument('--burst', type=int, default=10,
+                        help="client side burst")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+
+    args = getArgs()
+    # injected failures are expected, flickrapi would log every one of them
+    logging.getLogger('flickrapi').setLevel(logging.CRITICAL)
+    for files in re.split(r'\s*,\s*', args.files):
+        run(args, int(files))
@@ -1,34 +1,53 @@
 #!/usr/bin/env python3
 # encoding: utf8
 
+import json
 import logging
 import os.path
-import imghdr
+import queue
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import flickr_magic
+from flickr_walk import scan_files, entry_path, entry_size
+from flickr_retry import RetryScheduler, is_transient
+from flickr_ledger import StreamDigest
+
+VALID_NAME = re.compile(r'\.(jpe?g|gif|png|tiff?|heic|mp4|mp2|avi|wmv|mov|m4v)$',
+                        flags=re.IGNORECASE)
+
 
 def valid_img(f):
     """
     Is this a valid image that we can use to upload?
+    Files with a known extension are taken by name, others are sniffed
+    by their first bytes (see flickr_magic), once per path, mtime and size.
 
-    :param f: str that indicates the file directory.
+    :param f: str that indicates the file directory, or a DirEntry (its cached type is used).
     :return: boolean
     """
-    if not os.path.isfile(f) :
+    if isinstance(f, str):
+        if not os.path.isfile(f) :
+            return False
+    elif not f.is_file() :
         return False
-    if re.search(r'\.(jpg|gif|png|tiff|mp4|mp2|avi|wmv|mov|m4v)$', f, flags=re.IGNORECASE):
+    if VALID_NAME.search(entry_path(f)):
         return True
-    try:
-        file_type = imghdr.what(f)
-        supported_types = ['jpeg', 'gif', 'png']
-        if file_type in supported_types:
-            return True
-    except AttributeError as e:
-        # You probably passed something that is not a path.
-        logging.warning(e)
-    except IOError as e:
-        # You passed a path that does not exist, or you do not have access to it.
-        logging.warning(e)
-    return False
+    return flickr_magic.types.kind(f) in flickr_magic.UPLOADABLE
+
+
+def valid_imgs(entries):
+    """
+    valid_img() for a whole directory listing, the files without a known
+    extension sniffed as one batch.
+    :return: list of the valid entries, in the same order
+    """
+    entries = [f for f in entries
+               if (os.path.isfile(f) if isinstance(f, str) else f.is_file())]
+    unknown = [f for f in entries if not VALID_NAME.search(entry_path(f))]
+    kinds = flickr_magic.types.classify(unknown)
+    return [f for f in entries if kinds.get(entry_path(f), 'jpeg') in flickr_magic.UPLOADABLE]
 
 
 def get_upload_size(files):
@@ -41,10 +60,16 @@ def get_upload_size(files):
 
 
 class UploadStatus(object):
-    """Used to maintain state while performing uploads."""
-    # TODO: Is this actually being used?
+    """
+    Used to maintain state while performing uploads.
+
+    File sizes are read once into a list with running totals, so progress
+    updates do not touch the disk. Several files may be in flight at once;
+    update() is called with bytes sent so far for a file, finish() when it
+    is done (successfully or not).
+    """
 
-    def __init__(self, file_list):
+    def __init__(self, file_list, sizes=None):
         if isinstance(file_list, str):
             # The file list is a directory and should be converted into a directory list.
             file_list = [os.path.join(file_list, f)
@@ -52,9 +77,18 @@ class UploadStatus(object):
                          if not os.path.isdir(os.path.join(file_list, f))]
 
         self.file_list = file_list
-        self.total_upload_size = get_upload_size(self.file_list)
+        self.sizes = sizes if sizes is not None else [os.path.getsize(f) for f in file_list]
+        self.cumulative = [0]
+        for size in self.sizes:
+            self.cumulative.append(self.cumulative[-1] + size)
+        self.total_upload_size = self.cumulative[-1]
+        self.size_of = dict(zip(self.file_list, self.sizes))
+        self.in_flight = dict()
+        self.sent = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
         self._file_no = 0
-        self.file = self.get_current_file()
+        self.file = self.get_current_file() if file_list else None
 
     def increment(self):
         """
@@ -80,78 +114,392 @@ class UploadStatus(object):
         Total file size for files uploaded thus far.
         :return:
         """
-        return float(get_upload_size(self.file_list[0:self._file_no]))
+        return float(self.cumulative[self._file_no])
 
     def status(self, progress):
         """
         Progress: Float: How much of the currently uploading file has been uploaded.
         """
-        total = self.uploaded_thus_far() + float(progress * os.path.getsize(self.file)) / 100
+        total = self.uploaded_thus_far() + float(progress * self.sizes[self._file_no]) / 100
         return round(total / self.total_upload_size * 100, 2)
 
+    def update(self, f, sent):
+        """Bytes of file f sent so far."""
+        with self.lock:
+            self.sent += sent - self.in_flight.get(f, 0)
+            self.in_flight[f] = sent
+
+    def finish(self, f):
+        """File f is done, count all its bytes."""
+        with self.lock:
+            self.sent += self.size_of.get(f, 0) - self.in_flight.pop(f, 0)
+
+    def percent(self):
+        if not self.total_upload_size:
+            return 100.0
+        return round(float(self.sent) / self.total_upload_size * 100, 2)
+
+    def throughput(self):
+        """MB/s since start."""
+        elapsed = time.time() - self.started
+        return self.sent / elapsed / 1e6 if elapsed > 0 else 0.0
+
+    def eta(self):
+        """Seconds left at current throughput, None if unknown."""
+        rate = self.throughput()
+        if rate <= 0:
+            return None
+        return (self.total_upload_size - self.sent) / (rate * 1e6)
+
+    def report(self):
+        eta = self.eta()
+        eta = '%d:%02d:%02d' % (eta // 3600, eta % 3600 // 60, eta % 60) if eta is not None else '?'
+        return "%6.2f%% %6.2f MB/s ETA %s" % (self.percent(), self.throughput(), eta)
+
+
+class FileWithCallback(object):
+    """
+    File object for flickr.upload(fileobj=...) reporting bytes read.
+    :param callback: called with number of bytes read so far, or None
+    :param digest: StreamDigest fed with the blocks read, or None
+    """
+    def __init__(self, filename, callback, size=None, digest=None):
+        self.file = open(filename, 'rb')
+        self.callback = callback
+        self.digest = digest
+        # the following attributes and methods are required
+        self.len = size if size is not None else os.path.getsize(filename)
+        self.fileno = self.file.fileno
+        self.tell = self.file.tell
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        if self.digest != None :
+            self.digest.update(data)
+        if self.callback != None :
+            self.callback(self.file.tell())
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class PhotosetCache(object):
+    """
+    Title to photoset ID lookup shared by all uploads in a run.
+
+    The list of photosets is fetched from Flickr once (all pages) and kept
+    up to date as new photosets are created. If path is given the map is
+    saved there and reused by later runs until it is older than ttl seconds.
+    """
+    def __init__(self, flickr, path=None, ttl=24 * 3600, per_page=500):
+        self.flickr = flickr
+        self.path = path
+        self.ttl = ttl
+        self.per_page = per_page
+        self.titles = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.create_lock = threading.Lock()
+        self.members = dict()
+        self.member_locks = dict()
+
+    def read(self):
+        """Photoset map saved by an earlier run, or None if missing or expired."""
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as fd:
+                data = json.load(fd)
+        except (IOError, ValueError) as e:
+            logging.warning(e)
+            return None
+        if time.time() - data.get('time', 0) > self.ttl:
+            return None
+        return data.get('titles')
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'w') as fd:
+                json.dump({'time': time.time(), 'titles': self.titles}, fd)
+        except IOError as e:
+            logging.warning(e)
+
+    def fetch(self):
+        """Lists all photosets on Flickr, page by page."""
+        titles = dict()
+        page, pages = 1, 1
+        while page <= pages:
+            photosets = self.flickr.photosets_getList(
+                page=page, per_page=self.per_page).find("photosets")
+            pages = int(photosets.attrib.get("pages", 1))
+            for p in photosets.findall("photoset"):
+                titles.setdefault(p.find("title").text, p.attrib["id"])
+            page += 1
+        return titles
+
+    def load(self):
+        with self.lock:
+            if self.titles is None:
+                titles = self.read()
+                if titles is None:
+                    titles = self.fetch()
+                    self.titles = titles
+                    self.save()
+                else:
+                    self.titles = titles
+
+    def get(self, title):
+        """Photoset ID for title or None."""
+        self.load()
+        with self.lock:
+            photoset_id = self.titles.get(title)
+            if photoset_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return photoset_id
+
+    def add(self, title, photoset_id):
+        self.load()
+        with self.lock:
+            self.titles.setdefault(title, photoset_id)
+            self.save()
+
+    def own(self, photoset_id, primary_photo_id):
+        """
+        Photoset created by this run. Its members are kept here, so every
+        Photoset writing to it (several directories may share a title) can
+        replace the whole list with photosets.editPhotos without dropping
+        the photos the others added.
+        """
+        with self.lock:
+            self.members[photoset_id] = [primary_photo_id]
+            self.member_locks[photoset_id] = threading.Lock()
+
+    def owned(self, photoset_id):
+        with self.lock:
+            return photoset_id in self.members
+
+    def member_lock(self, photoset_id):
+        """Held while the members of an owned photoset are changed on Flickr."""
+        with self.lock:
+            return self.member_locks[photoset_id]
+
+    def stats(self):
+        return "photoset cache: %d hits, %d misses, %d photosets" % (
+            self.hits, self.misses, len(self.titles or {}))
+
 
 class Photoset(object):
     """
     Object that helps organize photos into sets.
 
+    Photos can be added all at once (__call__) or in several batches while
+    uploads are still running (extend). A set created in this run has its
+    membership kept in the shared cache, so its photos are set with one
+    photosets.editPhotos call, one writer at a time. Photos for a set that
+    existed before are added with photosets.addPhoto, chunks of chunk_size
+    ids running on up to jobs threads.
+
     Arguments
     flickr: A FlickrAPI object that grants access to your flickr API.
+    cache: PhotosetCache shared between Photoset objects, a private one is made if None.
     """
-    def __init__(self, flickr):
+    def __init__(self, flickr, cache=None, jobs=1, chunk_size=50):
         self.flickr = flickr
+        self.cache = cache or PhotosetCache(flickr)
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.title = None
         self.photoset_id = ''
+        self.created = False
+        self.photo_ids = []
 
     def exists(self, title):
         """Returns Photoset ID that matches title, if such a set exists.  Otherwise false."""
-        # TODO: What happens if there is no photoset in your account?
-        photosets = self.flickr.photosets_getList().find("photosets").findall("photoset")
-
-        for p in photosets:
-            if p.find("title").text == title:
-                return p.attrib["id"]
-        return False
+        return self.cache.get(title) or False
 
     def create(self, title):
         """Returns Photoset and returns ID."""
-        return self.flickr.photosets_create(
+        photoset_id = self.flickr.photosets_create(
             method='flickr.photosets.create',
             title=title,
             primary_photo_id=self.primary_photo_id
         ).find("photoset").attrib['id']
+        self.cache.add(title, photoset_id)
+        return photoset_id
 
     def get_photoset_id(self, title):
         """
         Get photoset ID from flickr for a photoset with the title 'title'
         :param title:
-        :return:
+        :return: True if photoset was created
         """
-        self.photoset_id = self.exists(title)
-        if self.photoset_id :
-            return False
-        self.photoset_id = self.create(title)
-        return True
+        # several directories may upload to the same title at once
+        with self.cache.create_lock:
+            self.photoset_id = self.exists(title)
+            if self.photoset_id :
+                return False
+            self.photoset_id = self.create(title)
+            self.cache.own(self.photoset_id, self.primary_photo_id)
+            return True
 
     def add_photo(self, id) :
         ret = self.flickr.photosets_addPhoto(photoset_id=self.photoset_id,
                                              photo_id=id)
         return ret
 
+    def add_chunk(self, chunk):
+        """
+        Adds chunk of photo ids one by one.
+        :return: list of (id, error) for photos that were not added
+        """
+        failed = []
+        for i in chunk:
+            try:
+                self.add_photo(i)
+            except Exception as e:
+                failed.append((i, e))
+        return failed
+
+    def edit_photos(self):
+        """Replaces photos of a photoset created in this run with members + photo_ids."""
+        members = self.cache.members[self.photoset_id]
+        # linked duplicates may already be in the set
+        known = set(members)
+        new = [i for i in self.photo_ids if i not in known]
+        self.flickr.photosets_editPhotos(photoset_id=self.photoset_id,
+                                         primary_photo_id=members[0],
+                                         photo_ids=','.join(members + new))
+        members.extend(new)
+
     def add_photos(self):
-        """Adds photo ids to photoset on Flickr."""
-        return [self.add_photo(i) for i in self.photo_ids]
+        """
+        Adds photo ids to photoset on Flickr.
+        :return: list of (chunk, [(id, error), ...]) for chunks with failures
+        """
+        if not self.created:
+            return self.add_chunks()
+        with self.cache.member_lock(self.photoset_id):
+            try:
+                self.edit_photos()
+                return []
+            except Exception as e:
+                print("editPhotos failed for photoset %s, adding one by one: %s"
+                      % (self.title, e))
+            return self.add_chunks()
+
+    def add_chunks(self):
+        """photosets.addPhoto for every photo id, in chunks."""
+        chunks = [self.photo_ids[i:i + self.chunk_size]
+                  for i in range(0, len(self.photo_ids), self.chunk_size)]
+        if self.jobs > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                results = list(executor.map(self.add_chunk, chunks))
+        else:
+            results = [self.add_chunk(c) for c in chunks]
+        failures = []
+        for n, (chunk, failed) in enumerate(zip(chunks, results)):
+            if failed:
+                print("photoset %s: chunk %d/%d, %d of %d photos not added: %s"
+                      % (self.title, n + 1, len(chunks), len(failed),
+                         len(chunk), failed[0][1]))
+                failures.append((chunk, failed))
+            if self.created:
+                # what did get added must be in the next editPhotos list
+                missing = set(i for i, _ in failed)
+                self.cache.members[self.photoset_id].extend(
+                    i for i in chunk if i not in missing)
+        return failures
+
+    def extend(self, title, ids):
+        """
+        Adds ids to photoset title. The photoset is looked up (or created with
+        ids[0] as primary photo) on the first call for a title, later calls
+        only add photos.
+        :return: failures as returned by add_photos()
+        """
+        ids = list(ids)
+        if len(ids) == 0 :
+            return []
+        with self.lock:
+            if title != self.title:
+                self.primary_photo_id = ids[0]
+                if self.get_photoset_id(title):
+                    ids.pop(0)
+                self.created = self.cache.owned(self.photoset_id)
+                self.title = title
+            self.photo_ids = ids
+            if self.photo_ids:
+                return self.add_photos()
+            return []
 
     def __call__(self, title, ids, primary_photo_id=0):
         """Generates photoset based on information passed in call"""
         if len(ids) == 0 :
             return None
-        self.primary_photo_id = primary_photo_id or ids[0]
-        self.photo_ids = ids
-        if self.get_photoset_id(title) :
-            self.photo_ids.remove(self.primary_photo_id)
-        if self.photo_ids:
-            response = self.add_photos()
-            return response
-        return None
+        ids = list(ids)
+        if primary_photo_id in ids:
+            ids.remove(primary_photo_id)
+            ids.insert(0, primary_photo_id)
+        self.title = None
+        return self.extend(title, ids)
+
+
+class PhotosetStage(object):
+    """
+    Background thread adding photos to a photoset as soon as they are uploaded.
+
+    The photoset is created when the first photo id arrives. Ids that queue
+    up while a Flickr call is in progress are added together in the next call.
+    """
+    def __init__(self, photoset, title):
+        self.photoset = photoset
+        self.title = title
+        self.queue = queue.Queue()
+        self.failures = []
+        self.added = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, photo_id):
+        self.queue.put(photo_id)
+
+    def run(self):
+        done = False
+        while not done:
+            ids = [self.queue.get()]
+            try:
+                while True:
+                    ids.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in ids:
+                done = True
+                ids = [i for i in ids if i is not None]
+            if not ids:
+                continue
+            try:
+                self.failures.extend(self.photoset.extend(self.title, ids))
+                self.added += len(ids)
+            except Exception as e:
+                print("failed to add %d photos to photoset %s: %s"
+                      % (len(ids), self.title, e))
+                self.failures.append((ids, [(i, e) for i in ids]))
+
+    def close(self):
+        """Waits until all queued photos are added."""
+        self.queue.put(None)
+        self.thread.join()
 
 
 class AbstractDirectoryUpload(object):
@@ -161,17 +509,20 @@ class AbstractDirectoryUpload(object):
     """
     def __init__(self):
         self.files = []
+        self.entries = []
 
     def filter_directory_contents(self, d, f):
-        """Return true for files we don't want in our list (directories for now)"""
-        return os.path.isdir(os.path.join(d, f))
+        """Return true for files we don't want in our list (directories for now).
+        f is a DirEntry from scan_files()."""
+        return f.is_dir()
 
     def get_directory_contents(self, d, **kwargs):
         """Get list of all files in a directory.
-        TODO: Maybe this is better as a generator?"""
-        self.files = sorted([os.path.join(d, f)
-                             for f in os.listdir(d)
-                             if not self.filter_directory_contents(d, f)])
+        Entries come from a single scandir pass and keep their cached stat
+        in self.entries, self.files holds their paths."""
+        self.entries = sorted(scan_files(d, lambda e: not self.filter_directory_contents(d, e)),
+                              key=entry_path)
+        self.files = [e.path for e in self.entries]
 
     def prehook(self, **kwargs):
         pass
@@ -199,7 +550,7 @@ class DirectoryFlickrUpload(AbstractDirectoryUpload):
     """
     Handles actual upload to Flickr.
     """
-    def __init__(self, flickr):
+    def __init__(self, flickr, photoset_cache=None):
         super(DirectoryFlickrUpload, self).__init__()
         self.ids = []
         self.tags = []
@@ -207,11 +558,12 @@ class DirectoryFlickrUpload(AbstractDirectoryUpload):
         self.responses = []
         self.failed_uploads = []
         self.flickr = flickr
-        self.create_photoset = Photoset(flickr)
+        self.create_photoset = Photoset(flickr, photoset_cache)
+        self.jobs = 1
+        self.lock = threading.Lock()
 
     def filter_directory_contents(self, d, f):
-        path = os.path.join(d, f)
-        return not valid_img(path)
+        return not valid_img(f)
 
     def open_output(self, path) :
         if path != None :
@@ -225,38 +577,170 @@ class DirectoryFlickrUpload(AbstractDirectoryUpload):
 
     def prehook(self, tags, pset, **kwargs):
         self.ids = []
-        self.tags = (' '.join('"' + item + '"' for item in tags))
+        # a str is already quoted (flickr_meta.MetadataResolver.tag_string)
+        if isinstance(tags, str):
+            self.tags = tags
+        else:
+            self.tags = (' '.join('"' + item + '"' for item in tags))
         self.photoset_name = pset
         self.log = self.open_output(kwargs.get('log'))
+        self.ledger = kwargs.get('ledger')
+        self.jobs = max(1, kwargs.get('jobs') or 1)
+        self.create_photoset.jobs = self.jobs
+        self.set_batch = kwargs.get('set_batch') or 0
+        self.pending_ids = []
+        self.stream = kwargs.get('stream', False)
+        self.stage = None
+        self.max_retries = kwargs.get('retries') or 0
+        self.retry_delay = kwargs.get('retry_delay') or 2.0
+        self.retries = None
+        self.retried = dict()
+        self.journal = kwargs.get('journal')
+        self.digests = dict()
+
+    def send(self, f, progress=True, **kwargs):
+        """
+        One upload attempt.
+        :return: (result, exception or None)
+        """
+        fileobj = None
+        size = self.progress.size_of.get(f)
+        # the ledger gets the digests of the bytes sent, not a second read
+        digest = StreamDigest(size) if self.ledger != None and size != None else None
+        start = time.time()
+        if self.journal != None :
+            self.journal.start(f, size)
+        try :
+            if progress or digest != None:
+                callback = (lambda sent: self.progress.update(f, sent)) if progress else None
+                fileobj = FileWithCallback(f, callback, size, digest)
+            result = self.flickr.upload(filename=f, fileobj=fileobj, tags=self.tags,
+                                        is_public=kwargs.get('is_public', 0),
+                                        is_family=kwargs.get('is_family', 0))
+            error = None
+        except Exception as e :
+            result, error = None, e
+        finally :
+            if fileobj != None :
+                fileobj.close()
+            if progress:
+                self.progress.finish(f)
+        ok = (result != None) and (result.attrib['stat'] == 'ok')
+        digests = digest.result() if ok and digest != None else (None, None)
+        if ok and digest != None :
+            with self.lock:
+                self.digests[f] = digests
+        if self.journal != None :
+            self.journal.finish(f, ok, result.find("photoid").text if ok else None,
+                                size if ok else 0, time.time() - start, *digests)
+        return result, error
 
     def flickr_upload(self, f, **kwargs):
         """
         Actually uploads file to Flickr.
+        Transient failures are handed to the retry scheduler.
         :param f:
         :param kwargs:
         :return:
         """
-        self.index += 1
-        print("Uploading %4d/%4d: %s" % (self.index, self.count, f))
-        try :
-            result = self.flickr.upload(filename=f, tags=self.tags,
-                                        is_public=kwargs.get('is_public', 0),
-                                        is_family=kwargs.get('is_family', 0))
-        except Exception as e :
-            print("; upload failed: %s" % e)
-            result = None
+        with self.lock:
+            self.index += 1
+            print("Uploading %4d/%4d: %s [%s]" % (self.index, self.count, f,
+                                                 self.progress.report()))
+        result, error = self.send(f, **kwargs)
         ok = (result != None) and (result.attrib['stat'] == 'ok')
-        if (not ok) and (result != None) :
+        if error != None :
+            print("; upload failed: %s" % error)
+        elif not ok :
             print("; upload failed.")
+        if not ok and self.retries != None and is_transient(result, error):
+            self.retries.submit(f, lambda: self.retry(f, **kwargs), self.retry_done)
+        self.record(f, result, ok)
+        return result
+
+    def retry(self, f, **kwargs):
+        """Upload attempt for RetryScheduler: (ok, transient, result)."""
+        result, error = self.send(f, progress=False, **kwargs)
+        ok = (result != None) and (result.attrib['stat'] == 'ok')
+        if not ok:
+            print("; retry of %s failed: %s" % (f, error if error != None else "stat=fail"))
+        return ok, is_transient(result, error), result
+
+    def retry_done(self, f, ok, result):
+        with self.lock:
+            self.retried[f] = result
+        if ok:
+            print("Uploaded on retry: %s" % f)
+            self.record(f, result, ok)
+
+    def record(self, f, result, ok):
+        """Logs the outcome for f and passes a new photo on to the photoset."""
         if self.log != None :
             tag = "+" if ok else "-"
-            self.log.write('%s,%s\n' % (tag, f))
-        return result
+            with self.lock:
+                self.log.write('%s,%s\n' % (tag, f))
+        photo_id = result.find("photoid").text if ok else None
+        if self.ledger != None :
+            with self.lock:
+                digest, partial = self.digests.pop(f, (None, None))
+            self.ledger.record(f, ok, photo_id=photo_id,
+                               photoset=self.photoset_name,
+                               digest=digest, partial=partial)
+        if ok and self.stage != None:
+            self.stage.put(photo_id)
+        elif ok and self.set_batch:
+            self.queue_for_photoset(photo_id)
+
+    def queue_for_photoset(self, photo_id):
+        """Adds uploaded photos to the photoset every self.set_batch photos."""
+        with self.lock:
+            self.pending_ids.append(photo_id)
+            if len(self.pending_ids) < self.set_batch:
+                return
+            batch, self.pending_ids = self.pending_ids, []
+        self.add_to_photoset(batch)
+
+    def add_to_photoset(self, ids):
+        try :
+            self.create_photoset.extend(self.photoset_name, ids)
+        except Exception as e :
+            print("failed to create photoset %s: %s" % (self.photoset_name, e))
+
+    def upload_one(self, f):
+        return (self.flickr_upload(f, is_public=0, is_family=0), f)
 
     def upload(self, **kwargs):
+        """
+        Uploads self.files, keeping up to self.jobs uploads in flight.
+        self.responses stays in the order of self.files.
+        In stream mode each uploaded photo goes straight to PhotosetStage.
+        Retries run alongside and their final results replace the failed
+        responses once the queue is done.
+        """
         self.count = len(self.files)
         self.index = 0
-        self.responses = [(self.flickr_upload(f, is_public=0, is_family=0), f) for f in self.files]
+        self.progress = UploadStatus(self.files,
+                                     [entry_size(e) for e in self.entries])
+        if self.stream and self.count:
+            self.stage = PhotosetStage(self.create_photoset,
+                                       self.photoset_name).start()
+        if self.max_retries and self.count:
+            self.retries = RetryScheduler(self.max_retries, self.retry_delay,
+                                          workers=self.jobs)
+        try:
+            if self.jobs > 1 and self.count > 1:
+                with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    self.responses = list(executor.map(self.upload_one, self.files))
+            else:
+                self.responses = [self.upload_one(f) for f in self.files]
+            if self.retries != None:
+                self.retries.join()
+                self.responses = [(self.retried.get(f, r), f) for (r, f) in self.responses]
+        finally:
+            if self.retries != None:
+                self.retries.close()
+            if self.stage != None:
+                self.stage.close()
 
     def parse_response(self, **kwargs):
         """
@@ -269,18 +753,31 @@ class DirectoryFlickrUpload(AbstractDirectoryUpload):
         self.failed_uploads = [f for (_, f) in fail_list]
         self.successful_uploads_count = len(self.ids)
         self.failed_uploads_count = len(self.failed_uploads)
+        if self.count:
+            print("%s: %d uploaded, %d failed, %.1f MB at %.2f MB/s" % (
+                self.directory, self.successful_uploads_count,
+                self.failed_uploads_count, self.progress.total_upload_size / 1e6,
+                self.progress.throughput()))
 
     def posthook(self, **kwargs):
-        try :
-            self.create_photoset(self.photoset_name, self.ids)
-        except Exception as e :
-            print("failed to create photoset %s: %s" % (e, self.photoset_name))
+        if self.stage != None:
+            # photos were already added by PhotosetStage during upload
+            self.stage = None
+        elif self.set_batch:
+            self.add_to_photoset(self.pending_ids)
+            self.pending_ids = []
+        else:
+            self.add_to_photoset(self.ids)
         self.handle_failed_uploads()
         if self.log != None :
             self.log.close()
 
     def handle_failed_uploads(self):
-        pass
+        """Reports files that failed even after retries."""
+        for f in self.failed_uploads:
+            print("Failed: %s" % f)
+        if self.retries != None:
+            print(self.retries.stats())
 
 
 class PublicDirectoryUpload(DirectoryFlickrUpload):
@@ -305,9 +802,10 @@ class FamilyDirectoryUpload(DirectoryFlickrUpload):
 
 
 class ArgFilesCollector :
-    """collect files specified as argument."""
+    """collect files specified as argument (paths or DirEntry objects)."""
     def get_directory_contents(self, d, **kwargs) :
-        self.files = sorted(kwargs.get('files'))
+        self.entries = sorted(kwargs.get('files'), key=entry_path)
+        self.files = [entry_path(e) for e in self.entries]
 
 class DirectoryFilesFlickrUpload(ArgFilesCollector, DirectoryFlickrUpload) :
     """Uploads specified files in a directory as "private" files."""
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+# Which files get uploaded, decided while the tree is scanned.
+#
+# .flickrignore in any directory holds gitignore style patterns for that
+# directory and everything below it:
+#
+#   # comment
+#   *.tmp           any file or directory named so, at any depth
+#   /drafts         only drafts next to this .flickrignore
+#   raw/            directories only
+#   **/export/*.png
+#   !keep.tmp       re-include something an earlier line ignored
+#
+# On top of that files can be selected with include/exclude regexes
+# (searched in the path), size and modification date.
+
+import argparse
+import os
+import re
+import time
+from flickr_walk import scan_dir
+
+IGNORE_FILE = '.flickrignore'
+
+# never uploaded, whatever the patterns say
+ALWAYS_EXCLUDED = {'tags.txt', 'title.txt', '.DS_Store', IGNORE_FILE}
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def parse_size(text):
+    """'500', '200K', '1.5M', '2G' -> bytes"""
+    o = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*$', text, flags=re.IGNORECASE)
+    if o is None:
+        raise argparse.ArgumentTypeError("bad size: %s" % text)
+    return int(float(o.group(1)) * SIZE_UNITS[o.group(2).upper()])
+
+
+def parse_date(text):
+    """'2016-05-01' or '2016-05-01 12:30' -> timestamp (local time)"""
+    for fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("bad date: %s" % text)
+
+
+def glob_to_regex(pattern):
+    """gitignore glob (no leading / or trailing /) -> regex source"""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('/**', i) and i + 3 == n:
+            out.append('/.*')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 2)
+            if j < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                out.append('[%s]' % body.replace('\\', '\\\\'))
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+def read_ignore(path):
+    """
+    Patterns of one ignore file.
+    :return: list of (regex source over paths relative to its directory,
+                      negated, directories only)
+    """
+    rules = []
+    try:
+        with open(path, encoding='utf8') as fd:
+            lines = fd.read().splitlines()
+    except (IOError, UnicodeDecodeError):
+        return rules
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.strip('/') if dir_only else line
+        anchored = '/' in line
+        line = line.lstrip('/')
+        if not line:
+            continue
+        source = glob_to_regex(line)
+        if not anchored:
+            source = '(?:.*/)?' + source
+        rules.append((source, negated, dir_only))
+    return rules
+
+
+class Matcher(object):
+    """
+    All ignore rules in force in one directory, from its own ignore file
+    and those above it, compiled into a single regex over paths relative
+    to the top directory. Directories are matched with a trailing slash.
+    Alternatives are in reverse order, so the first one that matches is the
+    last rule that applies, as in gitignore.
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        alternatives = []
+        for i in reversed(range(len(rules))):
+            source, negated, dir_only = rules[i]
+            alternatives.append('(?P<%s%d>%s%s)' % (
+                'n' if negated else 'i', i, source, '/' if dir_only else '/?'))
+        self.regex = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def ignored(self, rel, is_dir):
+        if self.regex is None:
+            return False
+        o = self.regex.fullmatch(rel + '/' if is_dir else rel)
+        return o is not None and o.lastgroup[0] == 'i'
+
+
+class FileFilter(object):
+    """
+    Selection of files under root, evaluated during the scan: excluded
+    directories are not listed at all, so nothing below them is read.
+    Matchers are compiled once per ignore file, directories without one
+    share their parent's.
+    """
+    def __init__(self, root, include=None, exclude=None, min_size=None,
+                 max_size=None, newer=None, older=None,
+                 ignore_file=IGNORE_FILE):
+        self.root = os.path.normpath(root)
+        self.prefix = os.path.join(self.root, '')
+        self.include = self.combine(include)
+        self.exclude = self.combine(exclude)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.newer = newer
+        self.older = older
+        self.ignore_file = ignore_file
+        self.matchers = dict()
+        self.pruned = 0
+        self.skipped = 0
+
+    @staticmethod
+    def combine(patterns):
+        patterns = [p for p in patterns or [] if p]
+        if not patterns:
+            return None
+        return re.compile('|'.join('(?:%s)' % p for p in patterns))
+
+    def relative(self, path):
+        if path.startswith(self.prefix):
+            return path[len(self.prefix):].replace(os.sep, '/')
+        rel = os.path.relpath(path, self.root)
+        return '' if rel == '.' else rel.replace(os.sep, '/')
+
+    def matcher(self, d):
+        """Matcher of directory d, its parent's with d's own ignore file appended."""
+        d = os.path.normpath(d)
+        m = self.matchers.get(d)
+        if m is not None:
+            return m
+        parent = os.path.dirname(d)
+        top = d == self.root or parent == d
+        inherited = Matcher([]) if top else self.matcher(parent)
+        own = []
+        if self.ignore_file:
+            prefix = self.relative(d)
+            prefix = re.escape(prefix + '/') if prefix else ''
+            own = [(prefix + source, negated, dir_only) for source, negated, dir_only
+                   in read_ignore(os.path.join(d, self.ignore_file))]
+        m = Matcher(inherited.rules + own) if own else inherited
+        self.matchers[d] = m
+        return m
+
+    def accept_dir(self, entry, m):
+        if self.exclude is not None and self.exclude.search(entry.path):
+            return False
+        return not m.ignored(self.relative(entry.path), True)
+
+    def accept_file(self, entry, m):
+        if entry.name in ALWAYS_EXCLUDED:
+            return False
+        path = entry.path
+        if self.include is not None and not self.include.search(path):
+            return False
+        if self.exclude is not None and self.exclude.search(path):
+            return False
+        if m.ignored(self.relative(path), False):
+            return False
+        if self.min_size or self.max_size or self.newer or self.older:
+            st = entry.stat()
+            if self.min_size and st.st_size < self.min_size:
+                return False
+            if self.max_size and st.st_size > self.max_size:
+                return False
+            if self.newer and st.st_mtime < self.newer:
+                return False
+            if self.older and st.st_mtime >= self.older:
+                return False
+        return True
+
+    def scan(self, path, accept=None):
+        """
+        scan_dir() of path with the filter applied.
+        :param accept: further test for files that pass the filter
+        :return: (list of file DirEntry, list of subdirectory paths to descend)
+        """
+        m = self.matcher(path)
+        counts = [0, 0]
+
+        def files(e):
+            if not self.accept_file(e, m):
+                counts[0] += 1
+                return False
+            return accept is None or accept(e)
+
+        def dirs(e):
+            if not self.accept_dir(e, m):
+                counts[1] += 1
+                return False
+            return True
+
+        regs, subdirs = scan_dir(path, files, dirs)
+        self.skipped += counts[0]
+        self.pruned += counts[1]
+        return regs, subdirs
+
+    def stats(self):
+        return "filter: %d files skipped, %d directories pruned, %d ignore files" % (
+            self.skipped, self.pruned,
+            len(set(id(m) for m in self.matchers.values() if m.rules)))
+
+
+def from_options(options):
+    """FileFilter for options.directory from the flickr_up command line."""
+    return FileFilter(options.directory,
+                      include=getattr(options, 'include', None),
+                      exclude=getattr(options, 'exclude', None),
+                      min_size=getattr(options, 'min_size', None),
+                      max_size=getattr(options, 'max_size', None),
+                      newer=getattr(options, 'newer', None),
+                      older=getattr(options, 'older', None),
+                      ignore_file=getattr(options, 'ignore_file', IGNORE_FILE))
+
+
+def add_arguments(parser):
+    """Filter options, shared by flickr_up and flickr_re."""
+    parser.add_argument('--include', dest="include", action="append",
+                        help="upload only files whose path matches this regex \
+                        (may be repeated)")
+    parser.add_argument('--exclude', dest="exclude", action="append",
+                        help="skip files and directories whose path matches \
+                        this regex (may be repeated)")
+    parser.add_argument('--min-size', dest="min_size", type=parse_size,
+                        help="skip files smaller than this (e.g. 100K)")
+    parser.add_argument('--max-size', dest="max_size", type=parse_size,
+                        help="skip files larger than this (e.g. 1G)")
+    parser.add_argument('--newer', dest="newer", type=parse_date,
+                        help="only files modified on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--older', dest="older", type=parse_date,
+                        help="only files modified before this date (YYYY-MM-DD)")
+    parser.add_argument('--ignore-file', dest="ignore_file", default=IGNORE_FILE,
+                        help="name of per directory files with gitignore \
+                        style patterns of files not to upload")
+
+
+def getArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('directory', nargs='?', default=os.getcwd(),
+                        help="directory to list files that would be uploaded from")
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+
+    args = getArgs()
+
+    filt = from_options(args)
+    stack = [args.directory]
+    while stack:
+        d = stack.pop()
+        regs, dirs = filt.scan(d)
+        stack.extend(sorted(dirs, reverse=True))
+        for e in sorted(regs, key=lambda e: e.name):
+            print(e.path)
+    print(filt.stats())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+# Bytes read from a request body (an upload) per socket send. Upload bodies
+# are streamed, so this is also the most memory an upload holds at once.
+BLOCK_SIZE = 256 * 1024
+
+
+class PoolAdapter(HTTPAdapter):
+    """
+    HTTPAdapter keeping up to pool_size keep-alive connections per host,
+    with counters telling how often a connection was reused.
+    """
+    def __init__(self, pool_size=8, blocksize=BLOCK_SIZE):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.connects = 0
+        self.blocksize = blocksize
+        super(PoolAdapter, self).__init__(pool_connections=4,
+                                          pool_maxsize=pool_size,
+                                          pool_block=True)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.blocksize:
+            kwargs['blocksize'] = self.blocksize
+        super(PoolAdapter, self).init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        def counting(cls):
+            class CountingConnection(cls):
+                def connect(self):
+                    with adapter.lock:
+                        adapter.connects += 1
+                    return super(CountingConnection, self).connect()
+            return CountingConnection
+
+        class CountingHTTPPool(HTTPConnectionPool):
+            ConnectionCls = counting(HTTPConnection)
+
+        class CountingHTTPSPool(HTTPSConnectionPool):
+            ConnectionCls = counting(HTTPSConnection)
+
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPPool,
+                                                   'https': CountingHTTPSPool}
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            self.sent += 1
+        return super(PoolAdapter, self).send(request, **kwargs)
+
+    def stats(self):
+        return "http: %d requests over %d connections (%d reused)" % (
+            self.sent, self.connects, self.sent - self.connects)
+
+
+def pooled_session(pool_size=8, blocksize=BLOCK_SIZE):
+    """:return: (requests.Session, its PoolAdapter)"""
+    session = requests.Session()
+    adapter = PoolAdapter(pool_size, blocksize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session, adapter
+
+
+def streams_uploads(flickrapi):
+    """
+    flickrapi 2.1 and later send the upload body with requests_toolbelt's
+    MultipartEncoder, which reads the file in blocks as the socket takes
+    them. Older versions build the whole multipart body in memory.
+    """
+    version = getattr(flickrapi, '__version__', '0')
+    try:
+        return tuple(int(x) for x in version.split('.')[:2]) >= (2, 1)
+    except ValueError:
+        return False
+
+
+def install_session(flickr, pool_size=8, blocksize=BLOCK_SIZE):
+    """
+    Makes FlickrAPI send its requests, uploads included, over a pooled
+    keep-alive session sized for the number of concurrent uploads, instead
+    of the session flickrapi shares between all its instances.
+    :return: PoolAdapter for connection reuse stats
+    """
+    session, adapter = pooled_session(pool_size, blocksize)
+    flickr.flickr_oauth.session = session
+    return adapter
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+# Append-only binary journal of upload attempts.
+#
+# Every record is <length><crc32><body>, the body a record type, a
+# timestamp and the fields of that type. A record cut short by a crash
+# fails its length or CRC check and everything from there on is dropped.
+#
+#   ./flickr_journal.py upload.journal            summary, files in flight
+#   ./flickr_journal.py upload.journal --compact  keep last record per file
+
+import argparse
+import os
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b'FLKJ\x01\x00\x00\x00'
+
+HEADER = struct.Struct('<II')             # body length, crc32 of body
+START = 1                                 # time, size, path
+FINISH = 2                                # time, ok, bytes, duration, photo id, path,
+                                          # sha1, partial sha1 (absent in old journals)
+
+START_FIELDS = struct.Struct('<BdQ')
+FINISH_FIELDS = struct.Struct('<Bd?Qd')
+STRING = struct.Struct('<H')
+
+# no sane record is bigger, a larger length means a corrupt header
+MAX_RECORD = 1 << 16
+
+
+def pack_str(s):
+    b = (s or '').encode('utf8', 'surrogateescape')
+    return STRING.pack(len(b)) + b
+
+
+def unpack_str(body, offset):
+    n, = STRING.unpack_from(body, offset)
+    offset += STRING.size
+    return body[offset:offset + n].decode('utf8', 'surrogateescape'), offset + n
+
+
+def encode(record):
+    """(type, time, ...) -> bytes of one record, header included"""
+    kind = record[0]
+    if kind == START:
+        _, stamp, path, size = record
+        body = START_FIELDS.pack(START, stamp, size) + pack_str(path)
+    else:
+        _, stamp, path, ok, photo_id, sent, duration, digest, partial = record
+        body = FINISH_FIELDS.pack(FINISH, stamp, ok, sent, duration) + \
+            pack_str(photo_id) + pack_str(path) + pack_str(digest) + pack_str(partial)
+    return HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode(body):
+    kind = body[0]
+    if kind == START:
+        _, stamp, size = START_FIELDS.unpack_from(body)
+        path, _ = unpack_str(body, START_FIELDS.size)
+        return (START, stamp, path, size)
+    if kind == FINISH:
+        _, stamp, ok, sent, duration = FINISH_FIELDS.unpack_from(body)
+        photo_id, offset = unpack_str(body, FINISH_FIELDS.size)
+        path, offset = unpack_str(body, offset)
+        digest = partial = ''
+        if offset < len(body):
+            digest, offset = unpack_str(body, offset)
+            partial, offset = unpack_str(body, offset)
+        return (FINISH, stamp, path, ok, photo_id or None, sent, duration,
+                digest or None, partial or None)
+    raise ValueError("unknown record type %d" % kind)
+
+
+def read_records(path):
+    """
+    :return: (list of records, offset just past the last good one)
+    """
+    records = []
+    with open(path, 'rb') as fd:
+        data = fd.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("%s is not an upload journal" % path)
+    offset = len(MAGIC)
+    while offset + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        body = data[start:start + length]
+        if length > MAX_RECORD or len(body) < length or zlib.crc32(body) != crc:
+            break
+        try:
+            records.append(decode(body))
+        except (ValueError, struct.error, IndexError):
+            break
+        offset = start + length
+    return records, offset
+
+
+class JournalState(object):
+    """What a journal says about every file, from its last record."""
+    def __init__(self, records=()):
+        self.last = dict()
+        self.records = 0
+        for r in records:
+            self.add(r)
+
+    def add(self, record):
+        self.records += 1
+        self.last[record[2]] = record
+
+    def uploaded(self):
+        """:return: dict path -> photo id of files whose last attempt succeeded"""
+        return dict((p, r[4]) for p, r in self.last.items() if r[0] == FINISH and r[3])
+
+    def digests(self, path):
+        """:return: (sha1, partial sha1) sent with the last upload of path, Nones if unknown"""
+        r = self.last.get(path)
+        return (r[7], r[8]) if r is not None and r[0] == FINISH else (None, None)
+
+    def failed(self):
+        return sorted(p for p, r in self.last.items() if r[0] == FINISH and not r[3])
+
+    def in_flight(self):
+        """Files started but never finished: the run died while sending them."""
+        return sorted(p for p, r in self.last.items() if r[0] == START)
+
+    def summary(self):
+        finished = [r for r in self.last.values() if r[0] == FINISH and r[3]]
+        sent = sum(r[5] for r in finished)
+        seconds = sum(r[6] for r in finished)
+        return "journal: %d records, %d files uploaded (%.1f MB, %.2f s each), " \
+            "%d failed, %d in flight" % (
+                self.records, len(finished), sent / 1e6,
+                seconds / len(finished) if finished else 0.0,
+                len(self.failed()), len(self.in_flight()))
+
+
+class UploadJournal(object):
+    """
+    Writer of the journal at path.
+
+    Opening recovers the existing journal: its records are read into
+    self.state (so the files in flight when an earlier run died are known)
+    and a torn record at the end is cut off before anything is appended.
+
+    Records are buffered and written with one fsync once sync_every of
+    them are waiting or sync_interval seconds have passed since the last
+    one. A crash loses at most those, never corrupts what was synced.
+    """
+    def __init__(self, path, sync_every=64, sync_interval=1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.synced = time.time()
+        self.syncs = 0
+        self.written = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            records, offset = read_records(path)
+            self.state = JournalState(records)
+            self.fd = open(path, 'r+b')
+            self.fd.truncate(offset)
+            self.fd.seek(offset)
+        else:
+            self.state = JournalState()
+            self.fd = open(path, 'wb')
+            self.fd.write(MAGIC)
+            self.sync()
+
+    def append(self, record):
+        data = encode(record)
+        with self.lock:
+            self.buffer.append(data)
+            self.state.add(record)
+            if len(self.buffer) >= self.sync_every or \
+                    time.time() - self.synced >= self.sync_interval:
+                self.flush()
+
+    def flush(self):
+        """Writes buffered records and fsyncs; caller holds self.lock."""
+        if self.buffer:
+            self.fd.write(b''.join(self.buffer))
+            self.written += len(self.buffer)
+            self.buffer = []
+        self.sync()
+
+    def sync(self):
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        self.syncs += 1
+        self.synced = time.time()
+
+    def start(self, path, size):
+        self.append((START, time.time(), path, size or 0))
+
+    def finish(self, path, ok, photo_id=None, sent=0, duration=0.0, digest=None,
+               partial=None):
+        self.append((FINISH, time.time(), path, bool(ok), photo_id, sent or 0,
+                     duration, digest, partial))
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.fd.close()
+
+    def stats(self):
+        return "journal: %d records written with %d fsyncs" % (self.written, self.syncs)
+
+
+def compact(path):
+    """
+    Rewrites the journal keeping only the last record of every file.
+    :return: (records before, records after)
+    """
+    records, _ = read_records(path)
+    state = JournalState(records)
+    kept = sorted(state.last.values(), key=lambda r: r[1])
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fd:
+        fd.write(MAGIC)
+        fd.write(b''.join(encode(r) for r in kept))
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp, path)
+    return len(records), len(kept)
+
+
+def recover(journal, ledger):
+    """
+    Brings the ledger up to date with a journal from an earlier run, which
+    may have died before the ledger saw its last uploads. Files are not
+    read again: their digests come from the journal, if it has them.
+    :return: (uploads added to the ledger, files that were in flight)
+    """
+    added = 0
+    for path, photo_id in journal.state.uploaded().items():
+        if not ledger.is_uploaded(path):
+            digest, partial = journal.state.digests(path)
+            ledger.record(path, True, photo_id=photo_id, digest=digest,
+                          partial=partial, rehash=False)
+            added += 1
+    return added, journal.state.in_flight()
+
+
+def getArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('journal', help="journal written by flickr_up.py --journal")
+    parser.add_argument('--compact', action="store_true", default=False,
+                        help="rewrite journal with only the last record of each file")
+    parser.add_argument('--failed', action="store_true", default=False,
+                        help="list files whose last attempt failed")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+
+    args = getArgs()
+
+    if args.compact:
+        before, after = compact(args.journal)
+        print("%s: %d records compacted to %d" % (args.journal, before, after))
+    records, _ = read_records(args.journal)
+    state = JournalState(records)
+    print(state.summary())
+    for path in state.in_flight():
+        print("in flight: %s" % path)
+    if args.failed:
+        for path in state.failed():
+            print("failed: %s" % path)
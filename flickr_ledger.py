@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def partial_digest(path, size, block_size=1 << 16):
+    """
+    SHA-1 of size and the first and last block of a file. Cheap first pass
+    before comparing full digests.
+    :return: hex digest or None if file cannot be read
+    """
+    h = hashlib.sha1(str(size).encode())
+    try:
+        with open(path, 'rb') as fd:
+            h.update(fd.read(block_size))
+            if size > 2 * block_size:
+                fd.seek(-block_size, os.SEEK_END)
+                h.update(fd.read(block_size))
+    except IOError as e:
+        logging.warning(e)
+        return None
+    return h.hexdigest()
+
+
+class StreamDigest(object):
+    """
+    file_digest() and partial_digest() of a file worked out from the blocks
+    read while it is uploaded, so it is not read again to be recorded.
+    Blocks must be fed in order, from the start of the file.
+    """
+    def __init__(self, size, block_size=1 << 16):
+        self.size = size
+        self.block_size = block_size
+        self.full = hashlib.sha1()
+        self.head = b''
+        self.tail = b''
+        self.seen = 0
+
+    def update(self, data):
+        self.full.update(data)
+        self.seen += len(data)
+        block = self.block_size
+        if len(self.head) < block:
+            self.head += data[:block - len(self.head)]
+        if len(data) >= block:
+            self.tail = data[-block:]
+        elif data:
+            self.tail = self.tail[len(self.tail) + len(data) - block:] + data
+
+    def result(self):
+        """:return: (digest, partial), (None, None) if the file was not read whole"""
+        if self.seen != self.size:
+            return None, None
+        h = hashlib.sha1(str(self.size).encode())
+        h.update(self.head)
+        if self.size > 2 * self.block_size:
+            h.update(self.tail)
+        return self.full.hexdigest(), h.hexdigest()
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    SHA-1 of file contents.
+    :param path: str path to file
+    :return: hex digest or None if file cannot be read
+    """
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as fd:
+            for block in iter(lambda: fd.read(block_size), b''):
+                h.update(block)
+    except IOError as e:
+        logging.warning(e)
+        return None
+    return h.hexdigest()
+
+
+class UploadLedger(object):
+    """
+    Persistent record of uploaded files.
+
+    Backed by SQLite (path is None means in-memory only). The whole ledger is
+    read into a dict once when opened so that is_uploaded() is a dict lookup
+    instead of a scan of the text log for every file. record() may be called
+    from several upload threads.
+
+    Uploaded files are also indexed by content (size, partial and full
+    SHA-1), so find_duplicate() can tell if the same bytes were uploaded
+    from another path.
+    """
+    LOG_LINE = re.compile(r'^([+-]),(.*)$')
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path or ':memory:',
+                                    check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS uploads (
+                path TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                photo_id TEXT,
+                photoset TEXT,
+                size INTEGER,
+                mtime REAL,
+                hash TEXT,
+                partial TEXT,
+                updated REAL)''')
+        self.conn.commit()
+        self.entries = dict()
+        self.sizes = set()
+        self.partials = set()
+        self.hashes = dict()
+        for row in self.conn.execute('''
+            SELECT path, status, photo_id, photoset, size, mtime, hash, partial
+            FROM uploads'''):
+            self.entries[row[0]] = row[1:]
+            self.index(row[1:])
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def status(self, path):
+        """'+', '-' or None if path was never attempted."""
+        entry = self.entries.get(path)
+        return entry[0] if entry else None
+
+    def photo_id(self, path):
+        entry = self.entries.get(path)
+        return entry[1] if entry else None
+
+    def is_uploaded(self, path):
+        """Is file already marked in ledger as uploaded."""
+        return self.status(path) == '+'
+
+    def index(self, entry):
+        status, photo_id, _, size, _, digest, partial = entry
+        if status == '+' and photo_id and digest and partial:
+            self.sizes.add(size)
+            self.partials.add((size, partial))
+            self.hashes.setdefault(digest, photo_id)
+
+    def find_duplicate(self, path, size):
+        """
+        Photo id of an uploaded file with the same contents as path, or None.
+        Only files whose size matches an uploaded one are read: first the
+        partial digest, the full digest only if that matches too.
+        :return: (photo_id, digest, partial) or None
+        """
+        if size not in self.sizes:
+            return None
+        partial = partial_digest(path, size)
+        if (size, partial) not in self.partials:
+            return None
+        digest = file_digest(path)
+        photo_id = self.hashes.get(digest)
+        if photo_id is None:
+            return None
+        return photo_id, digest, partial
+
+    def record(self, path, ok, photo_id=None, photoset=None, digest=None,
+               partial=None, rehash=True):
+        """
+        Store result of an upload attempt.
+        :param path: str uploaded file
+        :param ok: boolean upload succeeded
+        :param digest: content hash, computed here for successful uploads if
+            not given (uploads pass the StreamDigest result of what they sent)
+        :param rehash: False - never read the file, digests not given stay
+            unknown (the file is then not found as a duplicate)
+        """
+        try:
+            st = os.stat(path)
+            size, mtime = st.st_size, st.st_mtime
+        except OSError:
+            size, mtime = None, None
+        if ok and digest is None and rehash:
+            digest = file_digest(path)
+        if ok and partial is None and size is not None and rehash:
+            partial = partial_digest(path, size)
+        entry = ('+' if ok else '-', photo_id, photoset, size, mtime, digest,
+                 partial)
+        with self.lock:
+            self.entries[path] = entry
+            self.index(entry)
+            self.conn.execute('''
+                INSERT OR REPLACE INTO uploads
+                (path, status, photo_id, photoset, size, mtime, hash, partial,
+                 updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (path,) + entry + (time.time(),))
+            self.conn.commit()
+
+    def import_log(self, logfile):
+        """
+        Import '+,path' / '-,path' lines written by DirectoryFlickrUpload.
+        Later lines win over earlier ones; a failure in the text log never
+        downgrades a success already recorded with a photo id.
+        :return: number of entries changed
+        """
+        changed = dict()
+        try:
+            with open(logfile) as fd:
+                for line in fd:
+                    m = self.LOG_LINE.match(line.rstrip('\n'))
+                    if m:
+                        changed[m.group(2)] = m.group(1)
+        except IOError as e:
+            logging.warning(e)
+            return 0
+        rows = []
+        for path, status in changed.items():
+            entry = self.entries.get(path)
+            if entry is not None and (entry[0] == status or entry[1]):
+                continue
+            entry = (status, None, None, None, None, None, None)
+            self.entries[path] = entry
+            rows.append((path,) + entry + (time.time(),))
+        self.conn.executemany('''
+            INSERT OR REPLACE INTO uploads
+            (path, status, photo_id, photoset, size, mtime, hash, partial,
+             updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        self.conn.commit()
+        return len(rows)
+
+    def throughput(self, gap=300):
+        """
+        Upload speed of earlier runs: bytes of successful uploads over the
+        time they took, a pause longer than gap seconds starting a new run.
+        :return: bytes per second or None if nothing to measure
+        """
+        total, span = 0, 0.0
+        first = last = None
+        with self.lock:
+            rows = self.conn.execute('''
+                SELECT updated, size FROM uploads
+                WHERE status = '+' AND photo_id IS NOT NULL AND size IS NOT NULL
+                ORDER BY updated''').fetchall()
+        for updated, size in rows:
+            if last is None or updated - last > gap:
+                if last is not None:
+                    span += last - first
+                first = updated     # bytes of the first upload have no start time
+            else:
+                total += size
+            last = updated
+        if last is not None:
+            span += last - first
+        return total / span if span > 0 and total else None
+
+    def close(self):
+        self.conn.close()
+
+
+def open_ledger(path=None, log=None):
+    """
+    Open ledger at path (or in memory) and fold in an existing text log.
+    """
+    ledger = UploadLedger(path)
+    if log is not None and os.path.exists(log):
+        count = ledger.import_log(log)
+        if count:
+            print("Imported %d entries from %s" % (count, log))
+    return ledger
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+# File type detection from the first bytes of a file, replacing imghdr
+# (gone from Python 3.13, and it knows nothing about HEIC, RAW or video).
+#
+#   ./flickr_magic.py ~/Pictures/2016
+
+import argparse
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Bytes read from each file, enough for every signature below.
+HEADER_SIZE = 32
+
+# Types Flickr takes for upload. RAW files are recognised but, as before,
+# not uploaded.
+UPLOADABLE = {'jpeg', 'png', 'gif', 'tiff', 'heic',
+              'mp4', 'mov', 'm4v', '3gp', 'avi', 'wmv', 'mpeg', 'mts',
+              'mkv', 'webm', 'ogg', 'flv'}
+
+# Signatures at offset 0, longest first where one is a prefix of another.
+MAGIC = [
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'IIRO', 'raw'),                       # Olympus ORF
+    (b'IIU\x00', 'raw'),                    # Panasonic RW2
+    (b'FUJIFILMCCD-RAW', 'raw'),            # Fuji RAF
+    (b'\x00\x00\x01\xba', 'mpeg'),          # MPEG program stream
+    (b'\x00\x00\x01\xb3', 'mpeg'),          # MPEG video
+    (b'\x30\x26\xb2\x75\x8e\x66\xcf\x11', 'wmv'),   # ASF
+    (b'FLV\x01', 'flv'),
+    (b'OggS', 'ogg'),
+]
+
+# ISO base media (MP4, QuickTime, HEIF, Canon CR3) major brands.
+BRANDS = {
+    b'heic': 'heic', b'heix': 'heic', b'heim': 'heic', b'heis': 'heic',
+    b'hevc': 'heic', b'hevx': 'heic', b'mif1': 'heic', b'msf1': 'heic',
+    b'avif': 'avif', b'crx ': 'raw',
+    b'qt  ': 'mov', b'M4V ': 'm4v', b'M4VH': 'm4v', b'M4VP': 'm4v',
+}
+
+# TIFF based RAW formats only differ from TIFF by name.
+RAW_EXTENSIONS = {'.cr2', '.nef', '.nrw', '.arw', '.srf', '.sr2', '.dng',
+                  '.pef', '.orf', '.rw2', '.raf', '.3fr', '.erf', '.kdc',
+                  '.mrw', '.srw', '.x3f', '.iiq'}
+
+
+def sniff(header, name=''):
+    """
+    :param header: first HEADER_SIZE bytes of a file
+    :param name: file name, only used to tell TIFF from TIFF based RAW
+    :return: type name ('jpeg', 'heic', 'raw', 'mp4' ...) or None
+    """
+    for magic, kind in MAGIC:
+        if header.startswith(magic):
+            return kind
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        if header[8:10] == b'CR' or \
+                os.path.splitext(name)[1].lower() in RAW_EXTENSIONS:
+            return 'raw'
+        return 'tiff'
+    if header[4:8] == b'ftyp':
+        brand = header[8:12]
+        if brand in BRANDS:
+            return BRANDS[brand]
+        return '3gp' if brand.startswith(b'3g') else 'mp4'
+    if header[4:8] in (b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'):
+        return 'mov'                        # QuickTime without ftyp
+    if header[:4] == b'RIFF' and header[8:12] == b'AVI ':
+        return 'avi'
+    if header[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm' if b'webm' in header else 'mkv'
+    if header[:1] == b'\x47' and name.lower().endswith(('.mts', '.m2ts', '.ts')):
+        return 'mts'                        # transport stream sync byte
+    return None
+
+
+def read_header(path, size=HEADER_SIZE):
+    with open(path, 'rb') as fd:
+        return fd.read(size)
+
+
+class TypeCache(object):
+    """
+    Remembers the type of every file sniffed, keyed by path and valid while
+    its mtime and size stay the same, so a file is opened at most once per
+    run however many times it is filtered.
+    """
+    def __init__(self):
+        self.types = dict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.reads = 0
+
+    def kind(self, f):
+        """
+        :param f: str path or DirEntry (its cached stat is used)
+        :return: type name or None, also for files that cannot be read
+        """
+        path = getattr(f, 'path', f)
+        try:
+            st = os.stat(path) if isinstance(f, str) else f.stat()
+        except OSError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            cached = self.types.get(path)
+            if cached is not None and cached[0] == stamp:
+                self.hits += 1
+                return cached[1]
+        try:
+            kind = sniff(read_header(path), os.path.basename(path))
+        except OSError:
+            return None
+        with self.lock:
+            self.reads += 1
+            self.types[path] = (stamp, kind)
+        return kind
+
+    def classify(self, files, workers=4):
+        """
+        Types of a whole batch (a directory listing), headers read by
+        workers threads so slow disks and network shares are kept busy.
+        :return: dict path -> type name or None
+        """
+        files = list(files)
+        if workers > 1 and len(files) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                kinds = list(executor.map(self.kind, files))
+        else:
+            kinds = [self.kind(f) for f in files]
+        return dict((getattr(f, 'path', f), k) for f, k in zip(files, kinds))
+
+    def stats(self):
+        return "file types: %d sniffed, %d cached" % (self.reads, self.hits)
+
+
+# shared by valid_img() and everything else in the process
+types = TypeCache()
+
+
+def getArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('directory', nargs='?', default=os.getcwd(),
+                        help="directory with files to classify")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+
+    args = getArgs()
+
+    entries = [e for e in os.scandir(args.directory) if e.is_file()]
+    for path, kind in sorted(types.classify(entries).items()):
+        print("%-6s %s %s" % (kind or '?', '+' if kind in UPLOADABLE else ' ', path))
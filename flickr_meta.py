@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+# Tags and photoset titles from the tags.txt and title.txt files in photo
+# directories.
+#
+#   ./flickr_meta.py -i ~/Pictures ~/Pictures/2016/Rome
+
+import argparse
+import logging
+import os
+import re
+import threading
+
+TAGS_FILE = 'tags.txt'
+TITLE_FILE = 'title.txt'
+
+ITEM = re.compile(r'^\S.*$')
+
+
+def read_items(path):
+    """Non-empty lines of path not starting with white space, or [] if missing."""
+    items = []
+    try:
+        with open(path) as fd:
+            items = [line.rstrip() for line in fd if ITEM.search(line) is not None]
+    except IOError as e:
+        logging.warning(e)
+    return items
+
+
+class MetadataResolver(object):
+    """
+    Parsed sidecar files, kept by path and re-read only when their mtime
+    changes, so every tags.txt and title.txt is opened once per run however
+    many directories and uploads ask for it.
+
+    Tags may be inherited from the parent directories up to a root. The
+    inherited set of each directory is kept for the run, a subdirectory
+    adds its own tags to its parent's without going further up.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = dict()
+        self.inherited = dict()
+        self.strings = dict()
+        self.reads = 0
+        self.hits = 0
+
+    def items(self, path):
+        """Lines of a sidecar file as a tuple, () if there is none."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return ()
+        with self.lock:
+            cached = self.files.get(path)
+            if cached is not None and cached[0] == mtime:
+                self.hits += 1
+                return cached[1]
+        items = tuple(read_items(path))
+        with self.lock:
+            self.reads += 1
+            self.files[path] = (mtime, items)
+        return items
+
+    def own_tags(self, d):
+        return frozenset(self.items(os.path.join(d, TAGS_FILE)))
+
+    def inherited_tags(self, d, root):
+        """Tags of d and of every directory between it and root."""
+        d = os.path.normpath(d)
+        key = (d, root)
+        with self.lock:
+            tags = self.inherited.get(key)
+        if tags is not None:
+            return tags
+        tags = self.own_tags(d)
+        parent = os.path.dirname(d)
+        if d != root and parent != d and \
+                os.path.commonpath([root, parent]) == root:
+            tags = tags | self.inherited_tags(parent, root)
+        with self.lock:
+            self.inherited[key] = tags
+        return tags
+
+    def tags(self, d, extra=None, root=None):
+        """
+        :param extra: tags given on the command line, added to every directory
+        :param root: inherit tags.txt of parent directories up to root
+        :return: frozenset of tags
+        """
+        if root is None:
+            tags = self.own_tags(d)
+        else:
+            tags = self.inherited_tags(d, os.path.normpath(root))
+        return tags | frozenset(extra or ())
+
+    def title(self, d, default=None):
+        """First line of title.txt in d, or default."""
+        items = self.items(os.path.join(d, TITLE_FILE))
+        return items[0] if items else default
+
+    def tag_string(self, tags):
+        """Tags quoted and joined the way Flickr wants them, made once per set of tags."""
+        if isinstance(tags, str):
+            return tags
+        tags = frozenset(tags or ())
+        with self.lock:
+            s = self.strings.get(tags)
+        if s is None:
+            s = ' '.join('"' + item + '"' for item in sorted(tags))
+            with self.lock:
+                self.strings[tags] = s
+        return s
+
+    def stats(self):
+        return "metadata: %d sidecar files read, %d cached" % (self.reads, self.hits)
+
+
+# shared by flickr_up and everything else in the process
+metadata = MetadataResolver()
+
+
+def getArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('directory', nargs='?', default=os.getcwd(),
+                        help="photo directory")
+    parser.add_argument('-i', '--inherit', dest="root", default=None,
+                        help="inherit tags of parent directories up to this one")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+
+    args = getArgs()
+
+    directory = args.directory
+    print(metadata.title(directory, os.path.basename(os.path.normpath(directory))))
+    print(metadata.tag_string(metadata.tags(directory, root=args.root)))
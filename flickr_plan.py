@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+# Upload plans: what flickr_up.py would upload, where, and at what cost,
+# worked out without talking to Flickr.
+#
+#   ./flickr_up.py -r -L upload.db --photoset-cache sets.json --plan plan.json ~/Pictures
+#   ./flickr_up.py -L upload.db --from-plan plan.json
+#
+# The plan is JSON. Each directory lists its files with sizes, its photoset
+# title and tags, so uploading from a plan does not scan the tree again.
+
+import json
+import math
+import time
+from flickr_walk import entry_path, entry_size
+
+PLAN_VERSION = 1
+
+# bytes per second assumed when the ledger has no uploads to measure
+DEFAULT_THROUGHPUT = 1 << 20
+
+
+def estimate_calls(directories, existing, options):
+    """
+    Flickr API calls needed to upload the planned directories.
+    :param existing: set of photoset titles already on Flickr, None if unknown
+    :return: (number of calls, list of photoset titles to be created)
+    """
+    link = getattr(options, 'dedup', None) == 'link'
+    calls = 0 if existing is not None else 1      # photosets.getList
+    known = set(existing or ())
+    new = []
+    for job in directories:
+        n = len(job['files'])
+        linked = len(job['duplicates']) if link else 0
+        calls += n
+        title = job['photoset']
+        if title in known:
+            calls += n + linked                   # photosets.addPhoto each
+            continue
+        known.add(title)
+        new.append(title)
+        if options.stream:
+            batches = math.ceil(n / max(1, options.jobs))
+        elif options.set_batch:
+            batches = math.ceil(n / options.set_batch)
+        else:
+            batches = 1
+        # create, then one editPhotos per batch (the first batch's primary
+        # photo is already in the set) and one for linked duplicates
+        calls += 1 + (batches if n > 1 else max(0, batches - 1)) + min(1, linked)
+    return calls, new
+
+
+def make_plan(jobs, options, existing=None, throughput=None):
+    """
+    :param jobs: (directory, files, tags, photoset, duplicates) as scanned by flickr_up
+    :param existing: set of photoset titles known to exist, None if unknown
+    :param throughput: bytes per second measured by earlier runs, or None
+    :return: plan dict
+    """
+    directories = []
+    for directory, files, tags, photoset, dups in jobs:
+        sizes = [entry_size(f) for f in files]
+        directories.append({
+            'directory': directory,
+            'photoset': photoset,
+            'tags': sorted(tags or []),
+            'files': [[entry_path(f), s] for f, s in zip(files, sizes)],
+            'bytes': sum(sizes),
+            'duplicates': [[path, photo_id, digest, partial]
+                           for path, (photo_id, digest, partial) in dups],
+        })
+    calls, new = estimate_calls(directories, existing, options)
+    total_bytes = sum(d['bytes'] for d in directories)
+    rate = throughput or DEFAULT_THROUGHPUT
+    seconds = total_bytes / float(rate)
+    if options.rate:
+        seconds = max(seconds, calls / options.rate)
+    return {
+        'version': PLAN_VERSION,
+        'created': time.time(),
+        'root': options.directory,
+        'recursive': options.recursive,
+        'same_recursive': options.same_recursive,
+        'directories': directories,
+        'totals': {
+            'directories': len(directories),
+            'files': sum(len(d['files']) for d in directories),
+            'bytes': total_bytes,
+            'duplicates': sum(len(d['duplicates']) for d in directories),
+            'photosets': sorted(set(d['photoset'] for d in directories)),
+            'new_photosets': new if existing is not None else None,
+            'api_calls': calls,
+            'throughput': rate,
+            'throughput_measured': throughput is not None,
+            'seconds': round(seconds, 1),
+        },
+    }
+
+
+def write_plan(plan, path):
+    with open(path, 'w') as fd:
+        json.dump(plan, fd, indent=1)
+
+
+def read_plan(path):
+    with open(path) as fd:
+        plan = json.load(fd)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError("%s: unsupported plan version %s" % (path, plan.get('version')))
+    return plan
+
+
+def plan_jobs(plan, ledger=None):
+    """
+    Jobs of a plan in the form flickr_up scans them. Files uploaded since
+    the plan was made (according to ledger) are dropped.
+    :return: list of (directory, files, tags, photoset, duplicates)
+    """
+    jobs = []
+    for d in plan['directories']:
+        files = [path for path, _ in d['files']
+                 if ledger is None or not ledger.is_uploaded(path)]
+        dups = [(path, (photo_id, digest, partial))
+                for path, photo_id, digest, partial in d['duplicates']
+                if ledger is None or not ledger.is_uploaded(path)]
+        if files or dups:
+            jobs.append((d['directory'], files, set(d['tags']) or "",
+                         d['photoset'], dups))
+    return jobs
+
+
+def summary(plan):
+    t = plan['totals']
+    lines = ["%d files (%.1f MB) in %d directories, %d duplicates" % (
+        t['files'], t['bytes'] / 1e6, t['directories'], t['duplicates'])]
+    new = t['new_photosets']
+    lines.append("%d photosets, %s new" % (
+        len(t['photosets']), '?' if new is None else len(new)))
+    lines.append("about %d API calls, %s at %.2f MB/s (%s)" % (
+        t['api_calls'], time.strftime('%H:%M:%S', time.gmtime(t['seconds']))
+        if t['seconds'] < 86400 else '%.1f days' % (t['seconds'] / 86400.0),
+        t['throughput'] / 1e6,
+        'measured' if t['throughput_measured'] else 'assumed'))
+    return '\n'.join(lines)
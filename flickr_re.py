@@ -1,20 +1,27 @@
 #!/usr/bin/env python3
 # encoding: utf8
 
+import mmap
 import re
 import os
+import sys
 from configparser import ConfigParser
 import argparse
+import flickr_filter
+import flickr_ledger
+
+
+LOG_LINE = re.compile(rb'^([+-]),(.*?)\r?$', flags=re.MULTILINE)
 
 
 def check_log(flickr, options):
     # searches log with regex - not used at the moment
     logfile = options.log
-    filtr = options.regex
+    filtr = re.compile(options.regex)
     count = 0
     with open(logfile, 'r') as f:
-        for line in f.readlines():
-            o = re.search(filtr, line)
+        for line in f:
+            o = filtr.search(line)
             if o:
                 count += 1
                 print (o.group(1))
@@ -24,34 +31,104 @@ def check_log(flickr, options):
             print("Matched", count, "lines.")
 
 
-def is_excluded(path):
-    name = os.path.basename(path)
-    return (name == 'tags.txt') or (name == 'title.txt')
-
-
-def is_uploaded(x, logfile):
-    # is file x already marked in logfile as uploaded
-    line = '+,' + x
-    with open(logfile) as file:
-        if line in file.read():
-            print("Image", x, "already uploaded")
-            return True
+def log_lines(logfile):
+    """
+    Yields (status, path) of every '+,path' / '-,path' line, path as bytes.
+    The log is mapped into memory and scanned with one compiled regex, so
+    logs of any size are read without splitting them into line objects.
+    """
+    with open(logfile, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for o in LOG_LINE.finditer(data):
+                yield o.group(1), o.group(2)
+
+
+class LogStats(object):
+    """Aggregates of an upload log, gathered in one pass."""
+    def __init__(self, regex=None):
+        self.regex = re.compile(regex.encode('utf8')) if regex else None
+        self.attempts = 0
+        self.successes = 0
+        self.failures = 0
+        self.last = dict()
+
+    def add(self, status, path):
+        if self.regex is not None and not self.regex.search(path):
+            return
+        self.attempts += 1
+        if status == b'+':
+            self.successes += 1
+        else:
+            self.failures += 1
+        # a success is final, later attempts of the same path can't undo it
+        if self.last.get(path) != b'+':
+            self.last[path] = status
+
+    def read(self, logfile):
+        for status, path in log_lines(logfile):
+            self.add(status, path)
+        return self
+
+    def still_failed(self):
+        return sorted(p.decode('utf8', 'surrogateescape')
+                      for p, s in self.last.items() if s == b'-')
+
+    def failed_dirs(self):
+        """:return: [(directory, failed files), ...] most failures first"""
+        dirs = dict()
+        for p in self.still_failed():
+            d = os.path.dirname(p)
+            dirs[d] = dirs.get(d, 0) + 1
+        return sorted(dirs.items(), key=lambda x: (-x[1], x[0]))
+
+    def report(self, top=20):
+        uploaded = sum(1 for s in self.last.values() if s == b'+')
+        lines = ["%d attempts: %d succeeded, %d failed" % (
+                     self.attempts, self.successes, self.failures),
+                 "%d files: %d uploaded, %d still failed, %d attempts repeated" % (
+                     len(self.last), uploaded, len(self.last) - uploaded,
+                     self.attempts - len(self.last))]
+        for d, count in self.failed_dirs()[:top]:
+            lines.append("%6d failed  %s" % (count, d))
+        return '\n'.join(lines)
+
+
+def log_stats(options):
+    stats = LogStats(options.regex).read(options.log)
+    print(stats.report(options.top))
+    if options.retry_list:
+        with open(options.retry_list, 'w') as fd:
+            for p in stats.still_failed():
+                fd.write(p + '\n')
+        print("still failed files written to %s" % options.retry_list)
+    return stats
+
+
+def is_uploaded(x, ledger):
+    # is file x already marked in ledger as uploaded
+    if ledger.is_uploaded(x):
+        print("Image", x, "already uploaded")
+        return True
     return False
 
 
 def upload_dir(flickr, directory, options):
     # simplified version for testing
     logfile = options.log
-    file = options.filename
+    ledger = flickr_ledger.open_ledger(None, logfile)
 
     print(logfile)
-    print(file)
 
+    file_filter = flickr_filter.FileFilter(directory, include=[options.regex])
     try:
-        files = [('%s/%s' % (directory, x)) for x in os.listdir(directory)]
+        regs, _ = file_filter.scan(directory,
+                                   lambda e: not is_uploaded(e.path, ledger))
     except OSError:
-        files = []
-    print([x for x in files if (os.path.isfile(x) and not is_uploaded(x, logfile))])
+        regs = []
+    print(sorted(e.path for e in regs))
+    ledger.close()
 
 
 def is_valid_file(parser, arg):
@@ -120,8 +197,26 @@ def getArgs(argv=None):
     return parser.parse_args(argv)
 
 
+def getStatsArgs(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='flickr_re.py stats',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('log', help="upload log (+,path / -,path lines)")
+    parser.add_argument('-re', '--regex', default=None,
+                        help='only count paths matching this regex')
+    parser.add_argument('--top', type=int, default=20,
+                        help='directories with most failures to list')
+    parser.add_argument('--retry-list', dest="retry_list", default=None,
+                        help='write files whose last attempt failed to this file')
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
 
+    if sys.argv[1:2] == ['stats']:
+        log_stats(getStatsArgs(sys.argv[2:]))
+        sys.exit(0)
+
     # print (sys.version)
     config = ConfigParser()
     config.read('flickr.config')
@@ -142,4 +237,3 @@ if __name__ == '__main__':
     #     print("Check is not required")
 
     upload_dir(None, args.directory, args)
-    args.filename.close()
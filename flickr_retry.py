@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+
+# Flickr error codes that will not go away by trying again:
+# no photo, zero size, bad file type, upload limit, file too large,
+# SSL required, signature and auth errors, bad API key.
+PERMANENT_CODES = {'2', '4', '5', '6', '8', '95', '96', '97', '98', '99', '100'}
+
+TRANSIENT_MESSAGE = re.compile(
+    r'\b(429|5\d\d)\b|timed? ?out|temporar|unavailable|rate limit|connection',
+    flags=re.IGNORECASE)
+
+
+def is_transient(result=None, error=None):
+    """
+    Is a failed upload worth retrying?
+    :param result: Flickr response element (stat != 'ok') or None
+    :param error: exception raised by the upload or None
+    :return: boolean
+    """
+    if error is not None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        if status is not None:
+            return status == 429 or status >= 500
+        code = getattr(error, 'code', None)
+        if code is not None:
+            return str(code) not in PERMANENT_CODES
+        if isinstance(error, OSError):
+            # requests' ConnectionError and Timeout are OSErrors too
+            return True
+        return TRANSIENT_MESSAGE.search(str(error)) is not None
+    if result is not None:
+        err = result.find('err')
+        if err is not None:
+            return err.attrib.get('code') not in PERMANENT_CODES
+    return True
+
+
+class RetryScheduler(object):
+    """
+    Retries failed calls in the background with exponential backoff.
+
+    submit(key, call, done) schedules call() after a delay of about
+    base * 2 ** (attempt - 1) seconds (capped, half of it random jitter).
+    call() returns (ok, transient, result); a transient failure is tried
+    again until attempts is reached, then done(key, ok, result) is called
+    once with the final outcome. Calls run on worker threads, so the main
+    upload queue keeps going while failed files wait for their turn.
+    """
+    def __init__(self, attempts=3, base=2.0, cap=120.0, workers=1):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.pending = 0
+        self.closed = False
+        self.retried = 0
+        self.recovered = 0
+        self.given_up = 0
+        self.threads = [threading.Thread(target=self.run) for _ in range(max(1, workers))]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def delay(self, attempt):
+        d = min(self.cap, self.base * 2 ** (attempt - 1))
+        return d / 2 + random.uniform(0, d / 2)
+
+    def submit(self, key, call, done, attempt=1):
+        """Schedules retry number attempt of call."""
+        delay = self.delay(attempt)
+        print("retry %d/%d in %.1f s: %s" % (attempt, self.attempts, delay, key))
+        with self.cond:
+            if attempt == 1:
+                self.pending += 1
+            heapq.heappush(self.heap, (time.time() + delay, next(self.seq),
+                                       key, call, done, attempt))
+            self.cond.notify()
+
+    def next_item(self):
+        with self.cond:
+            while True:
+                if self.closed and not self.heap:
+                    return None
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                wait = self.heap[0][0] - time.time()
+                if wait <= 0:
+                    return heapq.heappop(self.heap)
+                self.cond.wait(wait)
+
+    def run(self):
+        while True:
+            item = self.next_item()
+            if item is None:
+                return
+            _, _, key, call, done, attempt = item
+            self.retried += 1
+            try:
+                ok, transient, result = call()
+            except Exception as e:
+                ok, transient, result = False, True, None
+                print("retry of %s failed: %s" % (key, e))
+            if not ok and transient and attempt < self.attempts:
+                self.submit(key, call, done, attempt + 1)
+                continue
+            try:
+                done(key, ok, result)
+            finally:
+                with self.cond:
+                    if ok:
+                        self.recovered += 1
+                    else:
+                        self.given_up += 1
+                    self.pending -= 1
+                    self.cond.notify_all()
+
+    def join(self):
+        """Waits until every submitted call succeeded or gave up."""
+        with self.cond:
+            while self.pending:
+                self.cond.wait()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join()
+
+    def stats(self):
+        return "retries: %d attempts, %d recovered, %d given up" % (
+            self.retried, self.recovered, self.given_up)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# encoding: utf8
+
+import threading
+import time
+from flickr_retry import is_transient
+
+
+class TokenBucket(object):
+    """
+    rate tokens per second, at most burst saved up. rate 0 means no limit.
+    """
+    def __init__(self, rate=0.0, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, sleeping until one is available. :return: seconds waited"""
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class AdaptiveLimit(object):
+    """
+    Number of requests allowed in flight, adjusted AIMD style.
+
+    Each success adds 1/limit (about +1 per round of requests), an error
+    halves it. A call much slower than the running average for its method
+    takes off 10%.
+    """
+    def __init__(self, maximum=8, minimum=1, slow_factor=3.0, smoothing=0.05):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.slow_factor = slow_factor
+        self.smoothing = smoothing
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.baseline = dict()
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """Waits for a free slot. :return: seconds waited"""
+        start = time.time()
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+        return time.time() - start
+
+    def release(self, name, latency, ok, sized=False):
+        """
+        :param sized: latency depends on payload size (uploads), not used as signal
+        """
+        with self.cond:
+            self.in_flight -= 1
+            slow = False
+            if ok and not sized:
+                base = self.baseline.get(name, latency)
+                slow = latency > self.slow_factor * base
+                self.baseline[name] = base + self.smoothing * (latency - base)
+            if not ok:
+                self.limit = max(self.minimum, self.limit / 2)
+            elif slow:
+                self.limit = max(self.minimum, self.limit * 0.9)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+
+class ThrottledFlickr(object):
+    """
+    Wraps a FlickrAPI object so every API call (upload, photosets_* ...)
+    shares one TokenBucket and one AdaptiveLimit, whichever thread makes it.
+    Other attributes are passed through untouched.
+    """
+    UNTHROTTLED = {'token_valid', 'get_request_token', 'auth_url',
+                   'get_access_token', 'authenticate_via_browser',
+                   'authenticate_console'}
+    SIZED = {'upload', 'replace'}
+
+    def __init__(self, flickr, rate=0.0, burst=10, max_in_flight=8):
+        self.flickr = flickr
+        self.bucket = TokenBucket(rate, burst)
+        self.limit = AdaptiveLimit(max_in_flight)
+        self.stats_lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0.0
+
+    def __getattr__(self, name):
+        attr = getattr(self.flickr, name)
+        if name in self.UNTHROTTLED or name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            waited = self.limit.acquire()
+            waited += self.bucket.acquire()
+            start = time.time()
+            ok = False
+            try:
+                result = attr(*args, **kwargs)
+                ok = True
+                return result
+            except Exception as e:
+                ok = not is_transient(error=e)
+                raise
+            finally:
+                self.limit.release(name, time.time() - start, ok,
+                                   sized=name in self.SIZED)
+                with self.stats_lock:
+                    self.calls += 1
+                    self.errors += 0 if ok else 1
+                    self.throttled += waited
+        return call
+
+    def stats(self):
+        return "api: %d calls, %d errors, %.1f s throttled, %d in flight allowed" % (
+            self.calls, self.errors, self.throttled, int(self.limit.limit))
@@ -4,51 +4,29 @@ import os
 import argparse
 from configparser import ConfigParser
 import logging
-import re
+import sys
+import time
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import flickrapi
 import flickr_cli
-try:
-    from os import scandir, walk
-except ImportError:
-    from scandir import scandir, walk
+import flickr_filter
+import flickr_http
+import flickr_journal
+import flickr_ledger
+import flickr_magic
+import flickr_plan
+import flickr_throttle
+from flickr_meta import metadata
 
 
-def folders(path):
-    for entry in scandir(path):
-        if not entry.name.startswith(path) and entry.is_dir():
-            yield entry.name
-
-def files(path):
-    for entry in scandir(path):
-       if not entry.name.startswith('.') and entry.is_file():
-           yield entry.path
-
-
-def read_items(path):
-    items = []
-    if os.path.exists(path):
-        try:
-            fd = open(path)
-            items = [line.rstrip()
-                     for line in fd if re.search(r'^\S.*$', line) is not None]
-            fd.close()
-        except IOError as e:
-            logging.warning(e)
-    return items
-
-
-def make_tags(dir, tags):
-    set0 = set(tags or [])
-    set1 = set(read_items('%s/tags.txt' % dir))
-    return set0.union(set1)
+def make_tags(dir, tags, root=None):
+    """tags.txt of dir (and of its parents up to root) plus tags; cached."""
+    return metadata.tags(dir, tags, root)
 
 
 def make_title(dir, pset):
-    items = read_items('%s/title.txt' % dir)
-    if len(items) > 0:
-        return items[0]
-    return pset
+    return metadata.title(dir, pset)
 
 
 def photoset_default_title(d):
@@ -56,61 +34,158 @@ def photoset_default_title(d):
     return make_title(d, name)
 
 
-def is_excluded(path):
-    name = os.path.basename(path)
-    return (name == 'tags.txt') or (name == 'title.txt') or (name == '.DS_Store')
-
-
-def is_uploaded(x, logfile):
-    # is file x already marked in logfile as uploaded
-    line = '+,' + x
-    with open(logfile) as file:
-        if line in file.read():
-            print("Image", x, "already uploaded")
-            return True
+def is_uploaded(x, ledger):
+    # is file x already marked in ledger as uploaded
+    if ledger is not None and ledger.is_uploaded(x):
+        print("Image", x, "already uploaded")
+        return True
     return False
 
 
-def upload_dir_rec0(flickr, directory, depth, tags, photoset, options):
-    tags0 = tags or make_tags(directory, options.tags) or ""
-    photoset0 = photoset or photoset_default_title(directory)
-    log = options.log
+def split_duplicates(entries, ledger):
+    """
+    Separates files whose contents were already uploaded from another path.
+    :return: (entries to upload, [(path, (photo_id, digest, partial)), ...])
+    """
+    regs, dups = [], []
+    for e in entries:
+        dup = ledger.find_duplicate(e.path, e.stat().st_size)
+        if dup is None:
+            regs.append(e)
+        else:
+            print("Image", e.path, "already uploaded as photo", dup[0])
+            dups.append((e.path, dup))
+    return regs, dups
+
+
+def upload_dir_job(flickr, directory, files, tags, photoset, options,
+                   ledger=None, photoset_cache=None, dups=(), journal=None):
+    """
+    Uploads files of one directory. Duplicates found by split_duplicates()
+    are added to the photoset with --dedup link instead of being uploaded.
+    :return: (directory, number of files, seconds)
+    """
+    start = time.time()
+    tags = metadata.tag_string(tags)
+    print(directory, tags, photoset)
 
-    try:
-        # files = [('%s/%s' % (directory, x)) for x in os.listdir(directory)]
-        files = files(directory)
-        dirs = folders(directory)
-    except OSError:
-        files = []
-        dirs = []
-    # regs = [x for x in files if (os.path.isfile(
-    #    x) and not is_excluded(x) and not is_uploaded(x, log))]
-    regs = [x for x in files if (not is_excluded(x) and not is_uploaded(x, log))]
-    # dirs = [x for x in files if os.path.isdir(x)]
-    files = None
-
-    print(directory, tags0, photoset0)
-
-    upload = flickr_cli.DirectoryFilesFlickrUpload(flickr)
-    upload(directory=directory, files=regs, pset=photoset0, tags=tags0,
-           log=log)
-    for subdir in dirs:
-        upload_dir_rec0(flickr, subdir, depth + 1, tags, photoset, options)
-
-
-def upload_dir_rec(flickr, options):
+    upload = flickr_cli.DirectoryFilesFlickrUpload(flickr, photoset_cache)
+    if files:
+        upload(directory=directory, files=files, pset=photoset, tags=tags,
+               log=options.log, ledger=ledger, jobs=options.jobs,
+               set_batch=options.set_batch, stream=options.stream,
+               retries=options.retries, retry_delay=options.retry_delay,
+               journal=journal)
+    if dups:
+        linked = None
+        if options.dedup == 'link':
+            linked = photoset
+            print("%s: adding %d duplicates to photoset %s" % (directory, len(dups), photoset))
+            try:
+                upload.create_photoset.extend(photoset, [dup[0] for _, dup in dups])
+            except Exception as e:
+                print("failed to add duplicates to photoset %s: %s" % (photoset, e))
+                linked = None
+        for path, (photo_id, digest, partial) in dups:
+            ledger.record(path, True, photo_id=photo_id, photoset=linked,
+                          digest=digest, partial=partial)
+    return directory, len(files), time.time() - start
+
+
+def scan_jobs(options, ledger=None, file_filter=None):
+    """
+    Walks the tree once with an explicit stack and yields every directory
+    with something to upload as (directory, files, tags, photoset, duplicates).
+    file_filter (flickr_filter.FileFilter, by default built from options)
+    decides which files are taken and which subtrees are not even listed.
+    -r uploads each directory to its own photoset, -R everything to the
+    photoset of the top directory, without either only the top directory
+    is uploaded.
+    """
     directory = options.directory
+    recursive = options.recursive or options.same_recursive
+    root = directory if getattr(options, 'inherit_tags', False) else None
     if options.same_recursive:
         tags = make_tags(directory, options.tags) or ""
         photoset = options.photoset or photoset_default_title(directory)
     else:
         tags = None
-        photoset = None
+        photoset = options.photoset if not recursive else None
 
-    upload_dir_rec0(flickr, directory, 0, tags, photoset, options)
+    if file_filter is None:
+        file_filter = flickr_filter.from_options(options)
 
+    def accept(e):
+        return not is_uploaded(e.path, ledger)
 
-def upload_dir(flickr, options):
+    stack = [directory]
+    while stack:
+        d = stack.pop()
+        try:
+            regs, dirs = file_filter.scan(d, accept)
+        except OSError as e:
+            logging.warning(e)
+            continue
+        regs = flickr_cli.valid_imgs(regs)
+        if recursive:
+            stack.extend(sorted(dirs, reverse=True))
+        dups = []
+        if ledger is not None and options.dedup != 'off':
+            regs, dups = split_duplicates(regs, ledger)
+        if not regs and not dups:
+            continue
+        tags0 = tags or make_tags(d, options.tags, root) or ""
+        photoset0 = photoset or photoset_default_title(d)
+        yield d, regs, tags0, photoset0, dups
+
+
+def upload_dir_rec(flickr, options, ledger=None, photoset_cache=None,
+                   file_filter=None, jobs=None, journal=None):
+    """
+    Hands every directory from scan_jobs() (or the given jobs, e.g. from a
+    plan) to a pool of options.dir_jobs workers as soon as it is scanned.
+    """
+    if jobs is None:
+        file_filter = file_filter or flickr_filter.from_options(options)
+        jobs = scan_jobs(options, ledger, file_filter)
+    start = time.time()
+    total = 0
+    futures = []
+    with ThreadPoolExecutor(max_workers=max(1, options.dir_jobs)) as executor:
+        for d, regs, tags, photoset, dups in jobs:
+            futures.append(executor.submit(upload_dir_job, flickr, d, regs,
+                                           tags, photoset, options, ledger,
+                                           photoset_cache, dups, journal))
+        for future in as_completed(futures):
+            try:
+                d, count, seconds = future.result()
+            except Exception as e:
+                print("directory upload failed: %s" % e)
+                continue
+            total += count
+            print("%s: %d files in %.1f s" % (d, count, seconds))
+    print("%d directories, %d files in %.1f s" % (len(futures), total,
+                                                   time.time() - start))
+    if file_filter is not None:
+        print(file_filter.stats())
+
+
+def plan_dir_rec(options, ledger=None, existing=None):
+    """
+    Dry run of upload_dir_rec(): scans the tree and consults the ledger
+    only, nothing is sent to Flickr.
+    :param existing: photoset titles known to exist (from --photoset-cache) or None
+    :return: plan dict, see flickr_plan
+    """
+    file_filter = flickr_filter.from_options(options)
+    throughput = ledger.throughput() if ledger is not None else None
+    plan = flickr_plan.make_plan(scan_jobs(options, ledger, file_filter),
+                                 options, existing, throughput)
+    print(file_filter.stats())
+    return plan
+
+
+def upload_dir(flickr, options, ledger=None, photoset_cache=None):
     directory = options.directory
     log = options.log
     tags = make_tags(directory, options.tags) or ""
@@ -118,9 +193,11 @@ def upload_dir(flickr, options):
 
     print(directory, tags, photoset)
 
-    upload = flickr_cli.DirectoryFlickrUpload(flickr)
+    upload = flickr_cli.DirectoryFlickrUpload(flickr, photoset_cache)
     upload(directory=directory, pset=photoset, tags=tags,
-           log=log)
+           log=log, ledger=ledger, jobs=options.jobs,
+           set_batch=options.set_batch, stream=options.stream,
+           retries=options.retries, retry_delay=options.retry_delay)
 
 
 def divide_files_by_dir(files):
@@ -133,16 +210,19 @@ def divide_files_by_dir(files):
     return list(dir2files.items())
 
 
-def upload_files(flickr, directory, files, options):
+def upload_files(flickr, directory, files, options, ledger=None,
+                 photoset_cache=None):
     tags = make_tags(directory, options.tags) or ""
     photoset = options.photoset or photoset_default_title(directory)
     log = options.log
 
     print(files, tags, photoset)
 
-    upload = flickr_cli.DirectoryFilesFlickrUpload(flickr)
+    upload = flickr_cli.DirectoryFilesFlickrUpload(flickr, photoset_cache)
     upload(directory=directory, files=files, pset=photoset, tags=tags,
-           log=log)
+           log=log, ledger=ledger, jobs=options.jobs,
+           set_batch=options.set_batch, stream=options.stream,
+           retries=options.retries, retry_delay=options.retry_delay)
 
 
 def getArgs(argv=None):
@@ -162,6 +242,72 @@ def getArgs(argv=None):
                         help="tags to apply to images")
     parser.add_argument('-l', '--log', '--logfile', dest="log", default=None,
                         help="log keeps track of uploaded files")
+    parser.add_argument('-L', '--ledger', dest="ledger", default=None,
+                        help="upload ledger (SQLite) with photo ids and hashes; \
+                        an existing log is imported into it")
+    parser.add_argument('--journal', dest="journal", default=None,
+                        help="binary journal of every upload attempt (photo id, \
+                        bytes, duration); after a crash its uploads are \
+                        recovered into the ledger")
+    parser.add_argument('-j', '--jobs', dest="jobs", type=int, default=1,
+                        help="number of uploads kept in flight")
+    parser.add_argument('--retries', dest="retries", type=int, default=3,
+                        help="times a failed upload is retried in the \
+                        background (timeouts, server errors, rate limits)")
+    parser.add_argument('--retry-delay', dest="retry_delay", type=float,
+                        default=2.0,
+                        help="seconds before first retry, doubled for each next one")
+    parser.add_argument('--dir-jobs', dest="dir_jobs", type=int, default=1,
+                        help="number of directories uploaded at the same time \
+                        with -r/-R")
+    parser.add_argument('--dedup', dest="dedup", default='link',
+                        choices=['off', 'skip', 'link'],
+                        help="files with the same contents as an uploaded one \
+                        are not uploaded again but added to the photoset \
+                        (link), skipped altogether (skip) or uploaded (off)")
+    parser.add_argument('--rate', dest="rate", type=float, default=0.0,
+                        help="Flickr API calls per second, shared by all \
+                        threads, 0 - no limit (Flickr allows 3600 an hour, \
+                        i.e. --rate 1)")
+    parser.add_argument('--burst', dest="burst", type=int, default=10,
+                        help="API calls allowed at once above --rate")
+    parser.add_argument('--max-in-flight', dest="max_in_flight", type=int,
+                        default=0,
+                        help="upper bound for adaptive number of concurrent \
+                        API calls (default jobs * dir-jobs)")
+    parser.add_argument('--pool-size', dest="pool_size", type=int, default=0,
+                        help="keep-alive HTTP connections kept open \
+                        (default as --max-in-flight)")
+    parser.add_argument('--block-size', dest="block_size", type=int,
+                        default=flickr_http.BLOCK_SIZE // 1024,
+                        help="KiB of a file read per socket send while \
+                        uploading, memory used by each upload in flight")
+    parser.add_argument('--set-batch', dest="set_batch", type=int, default=0,
+                        help="add photos to photoset in batches of this size \
+                        while uploading (0 - after directory is uploaded)")
+    parser.add_argument('--stream', dest="stream", action="store_true",
+                        default=False,
+                        help="add each photo to photoset as soon as it is \
+                        uploaded (overrides --set-batch)")
+    parser.add_argument('--photoset-cache', dest="photoset_cache",
+                        default=None,
+                        help="file caching photoset titles and ids between runs")
+    parser.add_argument('--photoset-cache-ttl', dest="photoset_cache_ttl",
+                        type=int, default=24 * 3600,
+                        help="seconds before cached photoset list is refreshed")
+    flickr_filter.add_arguments(parser)
+    parser.add_argument('--plan', dest="plan", default=None, metavar="FILE",
+                        help="dry run: write what would be uploaded, where, \
+                        and estimated API calls and time to FILE (JSON); \
+                        Flickr is not contacted")
+    parser.add_argument('--from-plan', dest="from_plan", default=None,
+                        metavar="FILE",
+                        help="upload the files listed in a plan written by \
+                        --plan instead of scanning directory")
+    parser.add_argument('--inherit-tags', dest="inherit_tags",
+                        action="store_true", default=False,
+                        help="with -r, tags.txt of parent directories apply \
+                        to their subdirectories too")
     recursive = parser.add_mutually_exclusive_group()
     recursive.add_argument('-r', '--recursive', action="store_true",
                            dest="recursive", default=False,
@@ -178,6 +324,20 @@ if __name__ == '__main__':
 
     args = getArgs()
 
+    if args.plan:
+        ledger = flickr_ledger.open_ledger(args.ledger, args.log)
+        # no TTL, an old list of photosets is better than none for a plan
+        titles = flickr_cli.PhotosetCache(None, args.photoset_cache,
+                                          float('inf')).read()
+        try:
+            plan = plan_dir_rec(args, ledger,
+                                set(titles) if titles is not None else None)
+        finally:
+            ledger.close()
+        flickr_plan.write_plan(plan, args.plan)
+        print(flickr_plan.summary(plan))
+        sys.exit(0)
+
     config = ConfigParser()
     config.read('flickr.config')
     api_key = config.get('flickr', 'key')
@@ -191,4 +351,40 @@ if __name__ == '__main__':
         verifier = str(input('Verifier code: '))
         flickr.get_access_token(verifier)
 
-    upload_dir_rec(flickr, args)
+    in_flight = args.max_in_flight or max(1, args.jobs * args.dir_jobs)
+    http = flickr_http.install_session(flickr, args.pool_size or in_flight,
+                                       args.block_size * 1024)
+    if not flickr_http.streams_uploads(flickrapi):
+        print("flickrapi %s loads whole files into memory for upload, \
+use 2.1 or later for big videos" % getattr(flickrapi, '__version__', '?'))
+    flickr = flickr_throttle.ThrottledFlickr(
+        flickr, rate=args.rate, burst=args.burst, max_in_flight=in_flight)
+    if args.rate:
+        print("API calls limited to %g per second (burst %d)" % (args.rate, args.burst))
+    ledger = flickr_ledger.open_ledger(args.ledger, args.log)
+    photoset_cache = flickr_cli.PhotosetCache(flickr, args.photoset_cache,
+                                              args.photoset_cache_ttl)
+    journal = None
+    if args.journal:
+        journal = flickr_journal.UploadJournal(args.journal)
+        added, unfinished = flickr_journal.recover(journal, ledger)
+        if added:
+            print("Recovered %d uploads from %s" % (added, args.journal))
+        for path in unfinished:
+            print("Was being uploaded when last run stopped, may be on Flickr twice: %s" % path)
+    jobs = None
+    if args.from_plan:
+        jobs = flickr_plan.plan_jobs(flickr_plan.read_plan(args.from_plan), ledger)
+    try:
+        upload_dir_rec(flickr, args, ledger, photoset_cache, jobs=jobs,
+                       journal=journal)
+    finally:
+        if journal is not None:
+            journal.close()
+            print(journal.stats())
+        ledger.close()
+        print(photoset_cache.stats())
+        print(flickr_magic.types.stats())
+        print(metadata.stats())
+        print(flickr.stats())
+        print(http.stats())
@@ -26,6 +26,51 @@ def files_path(path):
        if not entry.name.startswith('.') and entry.is_file():
            yield entry.path, entry.name
 
+
+def scan_files(path, accept=None):
+    """
+    Yields DirEntry of every regular, non-hidden file in path for which
+    accept(entry) is true. DirEntry caches is_file() and stat() so the same
+    entry can be filtered, sized and checked against the ledger without
+    further syscalls.
+    """
+    for entry in scandir(path):
+        if not entry.name.startswith('.') and entry.is_file():
+            if accept is None or accept(entry):
+                yield entry
+
+
+def scan_dir(path, accept=None, accept_dir=None):
+    """
+    One scandir pass over path.
+    :param accept_dir: subdirectories for which it is false are left out
+    :return: (list of accepted file DirEntry, list of subdirectory paths),
+             hidden entries are skipped
+    """
+    regs, dirs = [], []
+    for entry in scandir(path):
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir():
+            if accept_dir is None or accept_dir(entry):
+                dirs.append(entry.path)
+        elif entry.is_file() and (accept is None or accept(entry)):
+            regs.append(entry)
+    return regs, dirs
+
+
+def entry_path(f):
+    """Path of a DirEntry or of a plain str path."""
+    return getattr(f, 'path', f)
+
+
+def entry_size(f):
+    """Size of a DirEntry (cached stat) or of a plain str path."""
+    if isinstance(f, str):
+        return os.path.getsize(f)
+    return f.stat().st_size
+
+
 def getArgs(argv=None):
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -41,16 +86,16 @@ if __name__ == '__main__':
 
     directory = args.directory
 
-for d in folders(directory):
-    print(d)
+    for d in folders(directory):
+        print(d)
 
-print('---')
+    print('---')
 
-for f in files(directory):
-    print(f)
+    for f in scan_files(directory):
+        print(f.path, entry_size(f))
 
-print('---')
+    print('---')
 
-# for f in files_path(directory):
-    # print('%s/%s' % f)
-    # print('/'.join(str(e) for e in f))
+    # for f in files_path(directory):
+        # print('%s/%s' % f)
+        # print('/'.join(str(e) for e in f))
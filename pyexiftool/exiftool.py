@@ -61,6 +61,15 @@ import os
 import json
 import warnings
 import codecs
+import multiprocessing
+import re
+import threading
+import time
+
+try:        # Py3k compatibility
+    import queue
+except ImportError:
+    import Queue as queue
 
 try:        # Py3k compatibility
     basestring
@@ -78,10 +87,19 @@ If the executable is not located in one of the paths listed in the
 # The standard value should be fine.
 sentinel = b"{ready}"
 
+# What bytes.strip() removes, for stripping without a copy.
+_whitespace = bytearray(b" \t\n\r\x0b\x0c")
+
+# Sentinels of the groups written by ExifTool.execute_batch().
+_ready_numbered = re.compile(br"\{ready\d*\}")
+
 # The block size when reading from exiftool.  The standard value
 # should be fine, though other values might give better performance in
-# some cases.
+# some cases.  Reads start with this size and double, up to
+# max_block_size, while exiftool keeps filling them, so large outputs
+# are read in a few big blocks.
 block_size = 4096
+max_block_size = 1 << 20
 
 # This code has been adapted from Lib/os.py in the Python source tree
 # (sha1 265e36e277f3)
@@ -187,6 +205,18 @@ class ExifTool(object):
         del self._process
         self.running = False
 
+    def kill(self):
+        """Kill the ``exiftool`` process of this instance at once.
+
+        Unlike :py:meth:`terminate()` this does not wait for a command
+        in progress; a thread reading its output gets an ``IOError``.
+        """
+        if not self.running:
+            return
+        self.running = False
+        self._process.kill()
+        self._process.wait()
+
     def __enter__(self):
         self.start()
         return self
@@ -216,15 +246,92 @@ class ExifTool(object):
         .. note:: This is considered a low-level method, and should
            rarely be needed by application developers.
         """
+        return bytes(self.execute_raw(*params))
+
+    def execute_raw(self, *params):
+        """Execute the given batch of parameters, without copying the output.
+
+        Like :py:meth:`execute()`, but the output is returned as a
+        ``memoryview`` of the buffer it was read into.  This saves a
+        copy of large outputs that are only parsed or written
+        somewhere else.
+        """
         if not self.running:
             raise ValueError("ExifTool instance not running.")
         self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
         self._process.stdin.flush()
-        output = b""
+        return self._read_output(sentinel)
+
+    def _read_output(self, end):
+        """Read exiftool output up to ``end``.
+
+        The output is collected in one ``bytearray``, growing in place,
+        and only its last bytes are checked for ``end`` after each
+        read.  Returns a ``memoryview`` of the output without
+        surrounding whitespace and ``end``.
+        """
+        output = bytearray()
         fd = self._process.stdout.fileno()
-        while not output[-32:].strip().endswith(sentinel):
-            output += os.read(fd, block_size)
-        return output.strip()[:-len(sentinel)]
+        size = block_size
+        while True:
+            data = os.read(fd, size)
+            if not data:
+                raise IOError("exiftool exited before the end of its output")
+            output += data
+            if len(data) == size and size < max_block_size:
+                size *= 2
+            tail = bytes(output[-32:]).rstrip()
+            if tail.endswith(end):
+                break
+        stop = len(output)
+        while output[stop - 1] in _whitespace:
+            stop -= 1
+        stop -= len(end)
+        start = 0
+        while start < stop and output[start] in _whitespace:
+            start += 1
+        return memoryview(output)[start:max(start, stop)]
+
+    def execute_batch(self, *groups):
+        """Execute several batches of parameters with one round trip.
+
+        Each argument is a sequence of ``bytes`` parameters, as for
+        :py:meth:`execute()`.  All groups are written to ``exiftool``
+        at once, each ended by a numbered ``-executeNUM``, so the
+        per-command overhead of a round trip is paid once for the
+        whole batch.  The return value is a list with the output of
+        each group, in order.
+
+        The commands are written by a separate thread while the output
+        is read, so a batch of any size goes through: ``exiftool``
+        stops reading its input when nobody empties its output pipe.
+        """
+        if not self.running:
+            raise ValueError("ExifTool instance not running.")
+        if not groups:
+            return []
+        commands = []
+        for n, params in enumerate(groups):
+            commands.append(b"\n".join(tuple(params) + (b"-execute%d" % n,)))
+        errors = []
+        writer = threading.Thread(target=self._write,
+                                  args=(b"\n".join(commands) + b"\n", errors))
+        writer.daemon = True
+        writer.start()
+        output = bytes(self._read_output(b"{ready%d}" % (len(groups) - 1)))
+        writer.join()
+        if errors:
+            raise errors[0]
+        parts = _ready_numbered.split(output + b"{ready}")
+        return [p.strip() for p in parts[:len(groups)]]
+
+    def _write(self, data, errors):
+        """Write ``data`` to ``exiftool``, appending an exception to ``errors``."""
+        try:
+            self._process.stdin.write(data)
+            self._process.stdin.flush()
+        except (IOError, OSError) as e:
+            errors.append(e)
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -249,7 +356,8 @@ class ExifTool(object):
         as Unicode strings in Python 3.x.
         """
         params = map(fsencode, params)
-        return json.loads(self.execute(b"-j", *params).decode("utf-8"))
+        output = self.execute_raw(b"-j", *params)
+        return json.loads(codecs.decode(output, "utf-8"))
 
     def get_metadata_batch(self, filenames):
         """Return all meta-data for the given files.
@@ -323,3 +431,132 @@ class ExifTool(object):
         ``None`` if this tag was not found in the file.
         """
         return self.get_tag_batch(tag, [filename])[0]
+
+
+class ExifToolPool(object):
+    """Run several ``exiftool`` processes and share them between threads.
+
+    A single :py:class:`ExifTool` instance handles one command at a
+    time, and ``exiftool`` itself is single-threaded, so metadata work
+    on many files uses only one core.  A pool starts ``workers``
+    instances; every call is handed to an idle one, waiting until one
+    becomes free, so up to ``workers`` commands issued from different
+    threads run at the same time.  The pool offers the same methods as
+    :py:class:`ExifTool` (``execute()``, ``execute_json()``,
+    ``get_tags_batch()`` and so on) and can be used as a context
+    manager::
+
+        with ExifToolPool(4) as pool:
+            with ThreadPoolExecutor(4) as executor:
+                results = executor.map(pool.get_metadata, files)
+
+    :py:meth:`terminate()` waits for running commands to finish
+    before stopping the processes, for up to ``timeout`` seconds;
+    processes still busy after that are killed.
+
+    .. py:attribute:: running
+
+       A Boolean value indicating whether the processes of the pool are
+       running.
+    """
+
+    def __init__(self, workers=None, executable_=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = [ExifTool(executable_) for _ in range(max(1, workers))]
+        self._idle = queue.Queue()
+        self.running = False
+
+    def start(self):
+        """Start the ``exiftool`` processes of the pool."""
+        if self.running:
+            warnings.warn("ExifToolPool already running; doing nothing.")
+            return
+        for et in self.workers:
+            et.start()
+            self._idle.put(et)
+        self.running = True
+
+    def terminate(self, timeout=10.0):
+        """Wait for running commands, then terminate all processes.
+
+        Commands still running after ``timeout`` seconds (``0`` - do
+        not wait, e.g. when the thread that started them was
+        interrupted) have their processes killed.
+        """
+        if not self.running:
+            return
+        self.running = False
+        deadline = time.time() + timeout
+        stopped = []
+        while len(stopped) < len(self.workers):
+            try:
+                et = self._idle.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            et.terminate()
+            stopped.append(et)
+        for et in self.workers:
+            if et not in stopped:
+                et.kill()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.terminate()
+
+    def _call(self, method, *args):
+        if not self.running:
+            raise ValueError("ExifToolPool not running.")
+        # a pool terminated while waiting never hands out a worker again
+        while True:
+            try:
+                et = self._idle.get(timeout=0.5)
+            except queue.Empty:
+                if not self.running:
+                    raise ValueError("ExifToolPool not running.")
+                continue
+            if self.running:
+                break
+            self._idle.put(et)
+            raise ValueError("ExifToolPool not running.")
+        try:
+            return getattr(et, method)(*args)
+        finally:
+            self._idle.put(et)
+
+    def execute(self, *params):
+        """:py:meth:`ExifTool.execute()` on an idle worker."""
+        return self._call("execute", *params)
+
+    def execute_raw(self, *params):
+        """:py:meth:`ExifTool.execute_raw()` on an idle worker."""
+        return self._call("execute_raw", *params)
+
+    def execute_batch(self, *groups):
+        """:py:meth:`ExifTool.execute_batch()` on an idle worker."""
+        return self._call("execute_batch", *groups)
+
+    def execute_json(self, *params):
+        """:py:meth:`ExifTool.execute_json()` on an idle worker."""
+        return self._call("execute_json", *params)
+
+    def get_metadata_batch(self, filenames):
+        return self._call("get_metadata_batch", filenames)
+
+    def get_metadata(self, filename):
+        return self._call("get_metadata", filename)
+
+    def get_tags_batch(self, tags, filenames):
+        return self._call("get_tags_batch", tags, filenames)
+
+    def get_tags(self, tags, filename):
+        return self._call("get_tags", tags, filename)
+
+    def get_tag_batch(self, tag, filenames):
+        return self._call("get_tag_batch", tag, filenames)
+
+    def get_tag(self, tag, filename):
+        return self._call("get_tag", tag, filename)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Time get_metadata_batch() on many files with the output reader of
+ExifTool against the one it replaced, which concatenated every block
+read to a bytes object and so was quadratic in the size of the output.
+
+    python test/bench_read.py                  # rose.jpg 5000 times
+    python test/bench_read.py -n 20000 ~/Pictures/*.jpg
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import exiftool
+
+
+class OldReader(exiftool.ExifTool):
+    """ExifTool with the read loop as it was before."""
+
+    def _read_output(self, end):
+        output = b""
+        fd = self._process.stdout.fileno()
+        while not output[-32:].strip().endswith(end):
+            output += os.read(fd, 4096)
+        return output.strip()[:-len(end)]
+
+
+def best(et, files, repeat):
+    """Fastest of repeat get_metadata_batch(files), in seconds."""
+    times = []
+    for _ in range(repeat):
+        t = time.time()
+        metadata = et.get_metadata_batch(files)
+        times.append(time.time() - t)
+        assert len(metadata) == len(files)
+    return min(times)
+
+
+def getArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*",
+                        default=[os.path.join(os.path.dirname(__file__), "rose.jpg")],
+                        help="files to read, repeated up to -n")
+    parser.add_argument("-n", type=int, default=5000,
+                        help="number of files in the batch")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--executable", default=exiftool.executable)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+
+    args = getArgs()
+
+    files = (args.files * (args.n // len(args.files) + 1))[:args.n]
+    with exiftool.ExifTool(args.executable) as et:
+        size = len(et.execute(b"-j", *map(exiftool.fsencode, files)))
+        new = best(et, files, args.repeat)
+    with OldReader(args.executable) as et:
+        old = best(et, files, args.repeat)
+    print("%d files, %.1f MB of JSON" % (len(files), size / 1e6))
+    print("before: %.3f s" % old)
+    print("after:  %.3f s (%.1fx)" % (new, old / new if new else 0.0))
@@ -6,6 +6,9 @@ import unittest
 import exiftool
 import warnings
 import os
+import shutil
+import tempfile
+import threading
 
 class TestExifTool(unittest.TestCase):
     def setUp(self):
@@ -81,6 +84,92 @@ class TestExifTool(unittest.TestCase):
         self.assertEqual(tags0, dict((k, expected_data[0][k])
                                      for k in ["SourceFile", "XMP:Subject"]))
         self.assertEqual(tag0, "Röschen")
+    def test_execute_batch(self):
+        # Several write commands in one round trip, one output per group
+        script_path = os.path.dirname(__file__)
+        tmp = tempfile.mkdtemp()
+        try:
+            files = []
+            for name in ["a.jpg", "b.jpg"]:
+                f = os.path.join(tmp, name)
+                shutil.copy(os.path.join(script_path, "rose.jpg"), f)
+                files.append(f)
+            with self.et:
+                self.assertEqual(self.et.execute_batch(), [])
+                outputs = self.et.execute_batch(
+                    [b"-XMP:Subject=eins", b"-overwrite_original",
+                     exiftool.fsencode(files[0])],
+                    [b"-XMP:Subject=zwei", b"-overwrite_original",
+                     exiftool.fsencode(files[1])])
+                subjects = [self.et.get_tag("XMP:Subject", f) for f in files]
+            self.assertEqual(len(outputs), 2)
+            for output in outputs:
+                self.assertTrue(b"1 image files updated" in output)
+            self.assertEqual(subjects, ["eins", "zwei"])
+        finally:
+            shutil.rmtree(tmp)
+    def test_execute_batch_large(self):
+        # More input and output than fit in the pipe buffers at once
+        source_file = exiftool.fsencode(
+            os.path.join(os.path.dirname(__file__), "rose.jpg"))
+        n = 5000
+        with self.et:
+            outputs = self.et.execute_batch(
+                *[[b"-XMP:Subject", source_file] for i in range(n)])
+        self.assertEqual(len(outputs), n)
+        self.assertTrue(sum(len(o) for o in outputs) > 1 << 17)
+        for output in outputs:
+            self.assertTrue("Röschen".encode("utf-8") in output)
+    def test_execute_raw(self):
+        # Same output as execute(), as a view of the read buffer
+        source_file = os.path.join(os.path.dirname(__file__), "rose.jpg")
+        with self.et:
+            output = self.et.execute(b"-j", exiftool.fsencode(source_file))
+            raw = self.et.execute_raw(b"-j", exiftool.fsencode(source_file))
+        self.assertTrue(isinstance(raw, memoryview))
+        self.assertEqual(bytes(raw), output)
+        self.assertFalse(output.endswith(exiftool.sentinel))
+    def test_pool(self):
+        # Calls from several threads at once, each on its own process
+        script_path = os.path.dirname(__file__)
+        source_file = os.path.join(script_path, "rose.jpg")
+        pool = exiftool.ExifToolPool(2)
+        self.assertRaises(ValueError, pool.get_tag, "XMP:Subject", source_file)
+        with pool:
+            self.assertTrue(pool.running)
+            self.assertEqual(len(pool.workers), 2)
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(
+                pool.get_tag("XMP:Subject", source_file))) for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            processes = [w._process for w in pool.workers]
+        self.assertEqual(results, ["Röschen"] * 4)
+        self.assertFalse(pool.running)
+        for process in processes:
+            self.assertNotEqual(process.poll(), None)
+    def test_pool_terminate_busy(self):
+        # A worker never given back (its caller was interrupted) is
+        # killed, a thread waiting for a worker gets ValueError
+        pool = exiftool.ExifToolPool(1)
+        pool.start()
+        held = pool._idle.get()
+        errors = []
+        def call():
+            try:
+                pool.execute(b"-ver")
+            except ValueError as e:
+                errors.append(e)
+        waiter = threading.Thread(target=call)
+        waiter.start()
+        pool.terminate(timeout=0)
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(held.running)
+        self.assertFalse(pool.running)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import flickr_filter
+
+
+class TestPatterns(unittest.TestCase):
+    def match(self, pattern, path):
+        return re.fullmatch(flickr_filter.glob_to_regex(pattern), path) is not None
+
+    def test_glob(self):
+        self.assertTrue(self.match('*.tmp', 'a.tmp'))
+        self.assertFalse(self.match('*.tmp', 'd/a.tmp'))
+        self.assertTrue(self.match('img?.jpg', 'img1.jpg'))
+        self.assertTrue(self.match('img[0-9].jpg', 'img7.jpg'))
+        self.assertFalse(self.match('img[!0-9].jpg', 'img7.jpg'))
+        self.assertTrue(self.match('**/export/*.png', 'export/a.png'))
+        self.assertTrue(self.match('**/export/*.png', 'a/b/export/a.png'))
+        self.assertFalse(self.match('**/export/*.png', 'a/export/b/a.png'))
+        self.assertTrue(self.match('raw/**', 'raw/a/b.cr2'))
+
+    def test_read_ignore(self):
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d, flickr_filter.IGNORE_FILE)
+            with open(path, 'w') as fd:
+                fd.write("# comment\n\n*.tmp\n!keep.tmp\n/drafts\nraw/\n")
+            rules = flickr_filter.read_ignore(path)
+        finally:
+            shutil.rmtree(d)
+        self.assertEqual([(negated, dir_only) for _, negated, dir_only in rules],
+                         [(False, False), (True, False), (False, False), (False, True)])
+        m = flickr_filter.Matcher(rules)
+        self.assertTrue(m.ignored('a.tmp', False))
+        self.assertTrue(m.ignored('sub/a.tmp', False))
+        self.assertFalse(m.ignored('keep.tmp', False))          # negation
+        self.assertTrue(m.ignored('drafts', True))              # anchored
+        self.assertFalse(m.ignored('sub/drafts', True))
+        self.assertTrue(m.ignored('sub/raw', True))             # directories only
+        self.assertFalse(m.ignored('sub/raw', False))
+        self.assertFalse(m.ignored('a.jpg', False))
+
+    def test_last_rule_wins(self):
+        m = flickr_filter.Matcher([('(?:.*/)?' + flickr_filter.glob_to_regex('keep.tmp'), True, False),
+                                   ('(?:.*/)?' + flickr_filter.glob_to_regex('*.tmp'), False, False)])
+        self.assertTrue(m.ignored('keep.tmp', False))
+
+
+class TestFileFilter(unittest.TestCase):
+    FILES = ['a.jpg', 'x.tmp', 'keep.tmp', 'raw', 'drafts/d.jpg',
+             'sub/drafts/e.jpg', 'sub/raw/r.jpg', 'sub/x.tmp', 'sub/y.tmp',
+             'sub/export/p.png', 'sub/export/p.jpg', 'export/q.png',
+             'tags.txt']
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in self.FILES:
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fd:
+                fd.write(name)
+        with open(os.path.join(self.root, '.flickrignore'), 'w') as fd:
+            fd.write("*.tmp\n!keep.tmp\n/drafts\nraw/\n**/export/*.png\n")
+        with open(os.path.join(self.root, 'sub', '.flickrignore'), 'w') as fd:
+            fd.write("!x.tmp\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def walk(self, filt):
+        found = []
+        stack = [self.root]
+        while stack:
+            regs, dirs = filt.scan(stack.pop())
+            stack.extend(dirs)
+            found.extend(os.path.relpath(e.path, self.root).replace(os.sep, '/')
+                         for e in regs)
+        return sorted(found)
+
+    def test_ignore_files(self):
+        filt = flickr_filter.FileFilter(self.root)
+        self.assertEqual(self.walk(filt),
+                         ['a.jpg', 'keep.tmp', 'raw', 'sub/drafts/e.jpg',
+                          'sub/export/p.jpg', 'sub/x.tmp'])
+        self.assertEqual(filt.pruned, 2)        # drafts, sub/raw
+
+    def test_include_exclude(self):
+        filt = flickr_filter.FileFilter(self.root, include=[r'\.jpg$'],
+                                        exclude=['/sub/'], ignore_file=None)
+        self.assertEqual(self.walk(filt), ['a.jpg', 'drafts/d.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
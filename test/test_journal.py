@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import flickr_journal
+import flickr_ledger
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'upload.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, records):
+        journal = flickr_journal.UploadJournal(self.path)
+        for r in records:
+            journal.append(r)
+        journal.close()
+
+    def test_round_trip(self):
+        records = [(flickr_journal.START, 1.0, '/a/ż.jpg', 10),
+                   (flickr_journal.FINISH, 2.0, '/a/ż.jpg', True, '123', 10, 0.5,
+                    'f' * 40, 'e' * 40),
+                   (flickr_journal.FINISH, 3.0, '/a/b.jpg', False, None, 0, 0.1,
+                    None, None)]
+        self.write(records)
+        read, offset = flickr_journal.read_records(self.path)
+        self.assertEqual(read, records)
+        self.assertEqual(offset, os.path.getsize(self.path))
+
+    def test_torn_record_truncated_on_reopen(self):
+        self.write([(flickr_journal.START, 1.0, '/a/1.jpg', 10),
+                    (flickr_journal.START, 2.0, '/a/2.jpg', 20)])
+        good = os.path.getsize(self.path)
+        with open(self.path, 'ab') as fd:
+            fd.write(flickr_journal.encode(
+                (flickr_journal.START, 3.0, '/a/3.jpg', 30))[:-5])
+        journal = flickr_journal.UploadJournal(self.path)
+        self.assertEqual(journal.state.in_flight(), ['/a/1.jpg', '/a/2.jpg'])
+        self.assertEqual(os.path.getsize(self.path), good)
+        journal.finish('/a/1.jpg', True, '1', 10, 0.1)
+        journal.close()
+        read, _ = flickr_journal.read_records(self.path)
+        self.assertEqual([r[2] for r in read], ['/a/1.jpg', '/a/2.jpg', '/a/1.jpg'])
+
+    def test_corrupt_record_drops_rest(self):
+        self.write([(flickr_journal.START, 1.0, '/a/1.jpg', 10),
+                    (flickr_journal.START, 2.0, '/a/2.jpg', 20)])
+        with open(self.path, 'r+b') as fd:
+            fd.seek(-1, os.SEEK_END)
+            fd.write(b'\xff')
+        read, _ = flickr_journal.read_records(self.path)
+        self.assertEqual([r[2] for r in read], ['/a/1.jpg'])
+
+    def test_compact_keeps_last_record_per_file(self):
+        F = flickr_journal.FINISH
+        self.write([(flickr_journal.START, 1.0, '/a/1.jpg', 10),
+                    (F, 2.0, '/a/1.jpg', False, None, 0, 0.1, None, None),
+                    (flickr_journal.START, 3.0, '/a/2.jpg', 20),
+                    (flickr_journal.START, 4.0, '/a/1.jpg', 10),
+                    (F, 5.0, '/a/1.jpg', True, '11', 10, 0.2, None, None)])
+        self.assertEqual(flickr_journal.compact(self.path), (5, 2))
+        read, _ = flickr_journal.read_records(self.path)
+        self.assertEqual([(r[1], r[2]) for r in read],
+                         [(3.0, '/a/2.jpg'), (5.0, '/a/1.jpg')])
+        state = flickr_journal.JournalState(read)
+        self.assertEqual(state.uploaded(), {'/a/1.jpg': '11'})
+        self.assertEqual(state.in_flight(), ['/a/2.jpg'])
+
+    def test_recover_does_not_read_files(self):
+        # the uploaded file is gone: recover() must take the journal's word
+        self.write([(flickr_journal.FINISH, 1.0, '/gone/1.jpg', True, '11', 10,
+                     0.1, 'f' * 40, 'e' * 40)])
+        journal = flickr_journal.UploadJournal(self.path)
+        ledger = flickr_ledger.UploadLedger()
+        reads = []
+        digest = flickr_ledger.file_digest
+        flickr_ledger.file_digest = lambda *args: reads.append(args)
+        try:
+            self.assertEqual(flickr_journal.recover(journal, ledger), (1, []))
+        finally:
+            flickr_ledger.file_digest = digest
+            journal.close()
+        self.assertEqual(reads, [])
+        self.assertTrue(ledger.is_uploaded('/gone/1.jpg'))
+        self.assertEqual(ledger.entries['/gone/1.jpg'][5], 'f' * 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
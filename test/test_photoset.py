@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+import xml.etree.ElementTree as ET
+
+import flickr_cli
+
+
+class FakeFlickr(object):
+    """The photosets calls of FlickrAPI, kept in memory."""
+    def __init__(self, edit_failures=0, add_failures=()):
+        self.lock = threading.Lock()
+        self.photosets = dict()
+        self.edit_failures = edit_failures
+        self.add_failures = set(add_failures)
+        self.calls = []
+
+    def rsp(self, inner=''):
+        return ET.fromstring('<rsp stat="ok">%s</rsp>' % inner)
+
+    def photosets_getList(self, page=1, per_page=500):
+        with self.lock:
+            items = ''.join('<photoset id="%s"><title>%s</title></photoset>'
+                            % (i, s['title']) for i, s in self.photosets.items())
+        return self.rsp('<photosets page="1" pages="1">%s</photosets>' % items)
+
+    def photosets_create(self, method=None, title=None, primary_photo_id=None):
+        with self.lock:
+            photoset_id = str(100 + len(self.photosets))
+            self.photosets[photoset_id] = {'title': title,
+                                           'photos': [primary_photo_id]}
+        return self.rsp('<photoset id="%s" />' % photoset_id)
+
+    def photosets_addPhoto(self, photoset_id, photo_id):
+        with self.lock:
+            self.calls.append('addPhoto')
+            if photo_id in self.add_failures:
+                raise Exception("addPhoto failed")
+            self.photosets[photoset_id]['photos'].append(photo_id)
+        return self.rsp()
+
+    def photosets_editPhotos(self, photoset_id, primary_photo_id, photo_ids):
+        with self.lock:
+            self.calls.append('editPhotos')
+            if self.edit_failures:
+                self.edit_failures -= 1
+                raise Exception("editPhotos failed")
+            self.photosets[photoset_id]['photos'] = photo_ids.split(',')
+        return self.rsp()
+
+    def photos(self, title):
+        for s in self.photosets.values():
+            if s['title'] == title:
+                return sorted(s['photos'], key=int)
+
+
+class TestPhotoset(unittest.TestCase):
+    def setUp(self):
+        self.flickr = FakeFlickr()
+        self.cache = flickr_cli.PhotosetCache(self.flickr)
+
+    def test_created_set_uses_edit_photos(self):
+        photoset = flickr_cli.Photoset(self.flickr, self.cache)
+        photoset('T', ['1', '2', '3'])
+        self.assertEqual(self.flickr.photos('T'), ['1', '2', '3'])
+        self.assertEqual(self.flickr.calls, ['editPhotos'])
+
+    def test_existing_set_uses_add_photo(self):
+        self.flickr.photosets_create(title='T', primary_photo_id='1')
+        photoset = flickr_cli.Photoset(self.flickr, self.cache)
+        photoset('T', ['2', '3'])
+        self.assertEqual(self.flickr.photos('T'), ['1', '2', '3'])
+        self.assertEqual(self.flickr.calls, ['addPhoto', 'addPhoto'])
+
+    def test_batches_from_several_directories(self):
+        # -R: directories share the set, editPhotos must not drop the others' photos
+        a = flickr_cli.Photoset(self.flickr, self.cache)
+        b = flickr_cli.Photoset(self.flickr, self.cache)
+        a.extend('T', ['1', '2'])
+        b.extend('T', ['3', '4'])
+        a.extend('T', ['5'])
+        b.extend('T', ['6'])
+        self.assertEqual(self.flickr.photos('T'), ['1', '2', '3', '4', '5', '6'])
+
+    def test_edit_fallback_keeps_added_photos(self):
+        # editPhotos fails, addPhoto adds 2 and 4 but not 3; a later
+        # editPhotos from another directory must keep 2 and 4
+        self.flickr.edit_failures = 1
+        self.flickr.add_failures = {'3'}
+        failures = flickr_cli.Photoset(self.flickr, self.cache)('T', ['1', '2', '3', '4'])
+        self.assertEqual([[i for i, _ in failed] for _, failed in failures], [['3']])
+        self.assertEqual(self.flickr.photos('T'), ['1', '2', '4'])
+        flickr_cli.Photoset(self.flickr, self.cache).extend('T', ['5', '6'])
+        self.assertEqual(self.flickr.photos('T'), ['1', '2', '4', '5', '6'])
+
+    def test_duplicates_not_repeated(self):
+        photoset = flickr_cli.Photoset(self.flickr, self.cache)
+        photoset.extend('T', ['1', '2'])
+        photoset.extend('T', ['2', '3'])
+        self.assertEqual(self.flickr.photos('T'), ['1', '2', '3'])
+
+
+if __name__ == '__main__':
+    unittest.main()